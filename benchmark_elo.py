@@ -0,0 +1,254 @@
+"""
+Times the elo estimators on the full ESPN history, and checks that the
+integer-index, one-row-per-fight engine in BaseEloEstimator.fit reproduces
+the old one-hot sparse matmul implementation on doubled data.
+
+Also checks, on synthetic data, that the engine still matches the one-hot
+reference when the two rows of a fight don't mirror each other, and that
+AccEloEstimator._fit_ffill gives the same output as the old per-fighter
+ffill loop.
+
+Run from the root of the project, after clean_all_data.py:
+    python benchmark_elo.py
+"""
+
+import time
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+from scipy.special import expit
+from model.mma_elo_model import RealEloEstimator, BinaryEloEstimator, \
+    BinaryEloErrorEstimator, AccEloEstimator
+
+
+def onehot_fit(estimator, df):
+    """
+    Reference implementation of BaseEloEstimator.fit, using one-hot sparse
+    matmuls to gather and scatter fighter powers. Only used for benchmarking.
+    Returns the same dataframe as estimator.fit(df).
+    """
+    df = df.sort_values(["fight_id", "FighterID_espn", "OpponentID_espn"])\
+        .reset_index(drop=True)
+    estimator.fit_fighter_encoder(df["FighterID_espn"])
+    fighter_powers = np.zeros(len(estimator.fighter_index))
+    fighter_id_mat = estimator.transform_fighter_ids(df["FighterID_espn"])
+    opponent_id_mat = estimator.transform_fighter_ids(df["OpponentID_espn"])
+    fitted_elo_df = df[[
+        "fight_id", "FighterID_espn", "OpponentID_espn", "Date",
+        estimator.target_col,
+    ]].assign(
+        pred_elo_target=np.nan, fighter_elo=np.nan, opponent_elo=np.nan,
+        updated_fighter_elo=np.nan, updated_opponent_elo=np.nan,
+    )
+    X = estimator.extract_features(df)
+    for dt, grp in tqdm(df.groupby("Date")):
+        curr_fighter = fighter_id_mat[grp.index]
+        curr_opponent = opponent_id_mat[grp.index]
+        curr_fighter_powers = fighter_powers @ curr_fighter.T
+        curr_opponent_powers = fighter_powers @ curr_opponent.T
+        curr_X = X[grp.index]
+        fitted_elo_df.loc[grp.index, "pred_elo_target"] = estimator.predict_given_powers(
+            curr_fighter_powers, curr_opponent_powers, curr_X
+        )
+        fitted_elo_df.loc[grp.index, "fighter_elo"] = curr_fighter_powers
+        fitted_elo_df.loc[grp.index, "opponent_elo"] = curr_opponent_powers
+        fighter_delta, opponent_delta = estimator.get_elo_update(
+            grp[estimator.target_col].values, curr_fighter_powers, curr_opponent_powers, curr_X
+        )
+        # get_elo_update gives the full update for a fight, but every fight
+        # appears twice here, so each row only gets half of it
+        fighter_powers += 0.5 * fighter_delta @ curr_fighter
+        fighter_powers += 0.5 * opponent_delta @ curr_opponent
+        fitted_elo_df.loc[grp.index, "updated_fighter_elo"] = fighter_powers @ curr_fighter.T
+        fitted_elo_df.loc[grp.index, "updated_opponent_elo"] = fighter_powers @ curr_opponent.T
+    return fitted_elo_df
+
+
+def make_elo_df(n_fights=2000, n_fighters=300, n_dates=200, seed=0):
+    """
+    Synthetic doubled data whose two rows per fight don't mirror each
+    other: the implied logits include the vig, so they don't sum to 0, and
+    some targets are missing on just one row.
+    """
+    rng = np.random.default_rng(seed)
+    fighter_ids = np.array([f"{1000 + i}" for i in range(n_fighters)])
+    f = rng.integers(0, n_fighters, n_fights)
+    o = (f + rng.integers(1, n_fighters, n_fights)) % n_fighters
+    dates = pd.Timestamp("2000-01-01") + pd.to_timedelta(np.sort(rng.choice(7000, n_dates, replace=False)), unit="D")
+    skill = rng.normal(size=n_fighters)
+    diff = skill[f] - skill[o]
+    win = (rng.uniform(size=n_fights) < expit(diff)).astype(float)
+    fight_df = pd.DataFrame({
+        "fight_id": [f"fight_{i}" for i in range(n_fights)],
+        "FighterID_espn": fighter_ids[f],
+        "OpponentID_espn": fighter_ids[o],
+        "Date": dates[rng.integers(0, n_dates, n_fights)],
+        "diff_sqrt_SSL": diff + rng.normal(size=n_fights),
+        "win_target": win,
+        "implied_logit": 0.5 * diff,
+    })
+    mirror_df = fight_df.assign(
+        FighterID_espn=fight_df["OpponentID_espn"],
+        OpponentID_espn=fight_df["FighterID_espn"],
+        diff_sqrt_SSL=-fight_df["diff_sqrt_SSL"],
+        win_target=1 - fight_df["win_target"],
+        implied_logit=-fight_df["implied_logit"],
+    )
+    df = pd.concat([fight_df, mirror_df], ignore_index=True)
+    # the vig makes both fighters' implied probabilities a bit too high
+    df["implied_logit"] += 0.1 + 0.2 * rng.uniform(size=len(df))
+    is_missing = rng.uniform(size=len(df)) < 0.1
+    df.loc[is_missing, ["diff_sqrt_SSL", "win_target"]] = np.nan
+    return df
+
+
+def check_asymmetric_elo():
+    df = make_elo_df()
+    elo_cols = ["pred_elo_target", "fighter_elo", "opponent_elo",
+                "updated_fighter_elo", "updated_opponent_elo"]
+    for make_estimator in [
+        lambda: RealEloEstimator("diff_sqrt_SSL"),
+        lambda: BinaryEloEstimator("win_target"),
+        lambda: BinaryEloErrorEstimator("win_target", "implied_logit"),
+    ]:
+        ref_elo_df = onehot_fit(make_estimator(), df)
+        estimator = make_estimator()
+        fitted_elo_df = estimator.fit(df)
+        max_abs_diff = (fitted_elo_df[elo_cols] - ref_elo_df[elo_cols]).abs().max().max()
+        assert max_abs_diff < 1e-10, max_abs_diff
+        print(f"{type(estimator).__name__} on asymmetric rows: max abs diff {max_abs_diff:.2e}")
+
+
+class LoopFfillAccEloEstimator(AccEloEstimator):
+    """
+    AccEloEstimator with the old _fit_ffill, which loops over fighters and
+    .loc-assigns each one's career. Only used to check the long-format
+    groupby-ffill against.
+    """
+
+    def _fit_ffill(self, elo_df:pd.DataFrame):
+        elo_df = elo_df.copy()
+        drop_inds = (
+            (elo_df[self.landed_col].isnull() | elo_df[self.attempt_col].isnull()) &
+            (elo_df[self.landed_col+"_opp"].isnull() | elo_df[self.attempt_col+"_opp"].isnull())
+        )
+        df_with_target = elo_df.loc[~drop_inds].copy()
+        fighter_ids_with_target = set(df_with_target["FighterID_espn"]) | \
+                                  set(df_with_target["OpponentID_espn"])
+        useless_fighter_ids = set(self.fighter_index.fighter_ids) - fighter_ids_with_target
+        self.fighter_ids_with_target = pd.Series(sorted(fighter_ids_with_target))
+        if not elo_df[[self.landed_col, self.attempt_col, 
+                    self.landed_col+"_opp", self.attempt_col+"_opp"]].isnull().any().any():
+            self.useless_fighter_ids = pd.Series([], dtype='int64')
+            elo_df["p_fighter_hat"] = expit(elo_df["fighter_offense_elo"] - elo_df["opponent_defense_elo"])
+            elo_df["p_opponent_hat"] = expit(elo_df["opponent_offense_elo"] - elo_df["fighter_defense_elo"])
+            return elo_df
+        self.useless_fighter_ids = pd.Series(sorted(useless_fighter_ids))
+        is_useless_fighter  = elo_df["FighterID_espn"].isin(useless_fighter_ids)
+        is_useless_opponent = elo_df["OpponentID_espn"].isin(useless_fighter_ids)
+        elo_df.loc[is_useless_fighter, ['fighter_offense_elo', 'updated_fighter_offense_elo',
+                                        'fighter_defense_elo', 'updated_fighter_defense_elo']] = 0
+        elo_df.loc[is_useless_opponent, ['opponent_offense_elo', 'updated_opponent_offense_elo',
+                                         'opponent_defense_elo', 'updated_opponent_defense_elo']] = 0
+        for fighter_id in tqdm(fighter_ids_with_target):
+            is_fighter_bool  = elo_df["FighterID_espn"] == fighter_id
+            is_opponent_bool = elo_df["OpponentID_espn"] == fighter_id
+            is_fighter_ind = elo_df.index[is_fighter_bool]
+            is_opponent_ind = elo_df.index[is_opponent_bool]
+            for side in ["offense", "defense"]:
+                updated_fighter_elo = (
+                    elo_df[f"updated_fighter_{side}_elo"] * is_fighter_bool +
+                    elo_df[f"updated_opponent_{side}_elo"] * is_opponent_bool
+                ).loc[is_fighter_bool | is_opponent_bool]
+                updated_fighter_elo.iloc[0] = np.nan_to_num(updated_fighter_elo.iloc[0], 0)
+                updated_fighter_elo = updated_fighter_elo.ffill()
+                elo_df.loc[is_fighter_ind, f"fighter_{side}_elo"] = \
+                    elo_df.loc[is_fighter_ind, f"fighter_{side}_elo"]\
+                        .fillna(updated_fighter_elo)
+                elo_df.loc[is_opponent_ind, f"opponent_{side}_elo"] = \
+                    elo_df.loc[is_opponent_ind, f"opponent_{side}_elo"]\
+                        .fillna(updated_fighter_elo)
+                elo_df.loc[is_fighter_ind, f"updated_fighter_{side}_elo"] = \
+                    updated_fighter_elo.loc[is_fighter_ind]
+                elo_df.loc[is_opponent_ind, f"updated_opponent_{side}_elo"] = \
+                    updated_fighter_elo.loc[is_opponent_ind]
+        elo_df["p_fighter_hat"] = expit(elo_df["fighter_offense_elo"] - elo_df["opponent_defense_elo"])
+        elo_df["p_opponent_hat"] = expit(elo_df["opponent_offense_elo"] - elo_df["fighter_defense_elo"])
+        return elo_df
+
+
+def make_acc_df(n_fights=2000, n_fighters=300, missing_frac=0.3, seed=0):
+    """
+    Synthetic one-row-per-fight landed/attempted stats, with stats missing on
+    just one side of some fights, missing on every fighter's first fight,
+    and a few fighters who never have any stats at all.
+    """
+    rng = np.random.default_rng(seed)
+    fighter_ids = np.array([f"{1000 + i}" for i in range(n_fighters)])
+    f = rng.integers(0, n_fighters, n_fights)
+    o = (f + rng.integers(1, n_fighters, n_fights)) % n_fighters
+    attempts = rng.integers(1, 50, (n_fights, 2)).astype(float)
+    landed = np.floor(attempts * rng.uniform(size=(n_fights, 2)))
+    is_missing = rng.uniform(size=(n_fights, 2)) < missing_frac
+    df = pd.DataFrame({
+        "fight_id": [f"fight_{i}" for i in range(n_fights)],
+        "FighterID_espn": fighter_ids[f],
+        "OpponentID_espn": fighter_ids[o],
+        "Date": pd.Timestamp("2000-01-01") + pd.to_timedelta(np.sort(rng.integers(0, 7000, n_fights)), unit="D"),
+        "L": np.where(is_missing[:, 0], np.nan, landed[:, 0]),
+        "A": np.where(is_missing[:, 0], np.nan, attempts[:, 0]),
+        "L_opp": np.where(is_missing[:, 1], np.nan, landed[:, 1]),
+        "A_opp": np.where(is_missing[:, 1], np.nan, attempts[:, 1]),
+    })
+    # every fighter's first fight is missing stats on both sides
+    long_ids = pd.Series(np.concatenate([df["FighterID_espn"], df["OpponentID_espn"]]))
+    is_first = ~long_ids.duplicated().values
+    is_first_fight = is_first[:n_fights] | is_first[n_fights:]
+    # and some fighters never have stats at all
+    never_ids = fighter_ids[:n_fighters // 20]
+    is_never = df["FighterID_espn"].isin(never_ids) | df["OpponentID_espn"].isin(never_ids)
+    df.loc[is_first_fight | is_never, ["L", "A", "L_opp", "A_opp"]] = np.nan
+    return df
+
+
+def check_acc_ffill():
+    # with missing_frac=0, only first fights and never_ids are missing stats
+    for seed, missing_frac in enumerate([0.0, 0.2, 0.6, 0.9]):
+        df = make_acc_df(missing_frac=missing_frac, seed=seed)
+        ref_elo_df = LoopFfillAccEloEstimator("L", "A", alpha=0.3).fit(df)
+        estimator = AccEloEstimator("L", "A", alpha=0.3)
+        fitted_elo_df = estimator.fit(df)
+        pd.testing.assert_frame_equal(fitted_elo_df, ref_elo_df)
+        print(f"AccEloEstimator._fit_ffill, {missing_frac:.0%} missing: matches the per-fighter loop")
+
+
+def prep_dataset():
+    df = pd.read_csv("data/full_bfo_ufc_espn_data_clean.csv", parse_dates=["Date"])
+    df["win_target"] = df["FighterResult"].replace({"W":1, "L":0, "D":np.nan})
+    df["diff_sqrt_SSL"] = np.sqrt(df["SSL"]) - np.sqrt(df["SSL_opp"])
+    return df
+
+
+if __name__ == "__main__":
+    check_asymmetric_elo()
+    check_acc_ffill()
+    df = prep_dataset()
+    print(f"{len(df)} rows, {df['Date'].nunique()} dates")
+    for estimator_class, target_col in [
+        (RealEloEstimator, "diff_sqrt_SSL"),
+        (BinaryEloEstimator, "win_target"),
+    ]:
+        start = time.time()
+        ref_elo_df = onehot_fit(estimator_class(target_col), df)
+        onehot_time = time.time() - start
+
+        start = time.time()
+        fitted_elo_df = estimator_class(target_col).fit(df)
+        engine_time = time.time() - start
+
+        elo_cols = ["pred_elo_target", "fighter_elo", "opponent_elo",
+                    "updated_fighter_elo", "updated_opponent_elo"]
+        max_abs_diff = (fitted_elo_df[elo_cols] - ref_elo_df[elo_cols]).abs().max().max()
+        print(f"{estimator_class.__name__}: one-hot {onehot_time:.2f}s, "
+              f"integer-index {engine_time:.2f}s ({onehot_time / engine_time:.1f}x), "
+              f"max abs diff {max_abs_diff:.2e}")
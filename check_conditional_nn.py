@@ -0,0 +1,156 @@
+"""
+Checks that the batched training engine in model/mma_conditional_nn.py
+(_train_batched, used by fit_predict_batched) trains each model the same way
+torch.optim.Adam would. With one model, the same initial weights and the same
+row order every epoch, it should end up with the same weights as a plain
+per-model Adam loop, up to float32 rounding. The same goes for each model when
+several are trained at once on different numbers of rows, with different
+learning rates. Then times K fold models trained one at a time with
+fit_predict against all at once with fit_predict_batched.
+
+    python check_conditional_nn.py
+"""
+
+import time
+import numpy as np
+import pandas as pd
+import torch
+from scipy.special import expit
+from model.mma_conditional_nn import (
+    SymmetricModel, BatchedSymmetricModel, NonSymmetricModel, BatchedNonSymmetricModel,
+    SymmetricModelWrapper, _train_batched, _predict_batched,
+)
+
+
+def copy_weights(model, batched_model, k=0):
+    """
+    Set the k-th model in a BatchedSymmetricModel or BatchedNonSymmetricModel
+    to the weights of model.
+    """
+    with torch.no_grad():
+        for name, linear in model.named_children():
+            if not isinstance(linear, torch.nn.Linear):
+                continue
+            batched_linear = getattr(batched_model, name)
+            batched_linear.weight[k] = linear.weight.T
+            if linear.bias is not None:
+                batched_linear.bias[k, 0] = linear.bias
+
+
+def adam_reference(model, X_f, X_o, y, ml_logit, lr, n_epochs, batch_size,
+                   n_models=1, max_rows=None, k=0):
+    """
+    Per-model torch.optim.Adam loop, drawing each epoch's row order from
+    torch's RNG exactly like _train_batched does for the k-th of n_models
+    models, the largest of which has max_rows rows.
+    """
+    if max_rows is None:
+        max_rows = len(y)
+    optimizer = torch.optim.Adam(model.parameters(), lr=lr)
+    loss_fn = torch.nn.BCELoss()
+    X_f = torch.as_tensor(X_f, dtype=torch.float32)
+    X_o = torch.as_tensor(X_o, dtype=torch.float32)
+    y = torch.as_tensor(y, dtype=torch.float32).view(-1, 1)
+    ml = torch.as_tensor(ml_logit, dtype=torch.float32).view(-1, 1)
+    for epoch in range(n_epochs):
+        keys = torch.rand(n_models, max_rows)[k]
+        keys[len(y):] = 2.0
+        order = keys.argsort()[:len(y)]
+        for start in range(0, len(y), batch_size):
+            rows = order[start:start+batch_size]
+            optimizer.zero_grad()
+            loss = loss_fn(model(ml[rows], X_f[rows], X_o[rows]), y[rows])
+            loss.backward()
+            optimizer.step()
+    return model
+
+
+def make_data(n_rows=1000, input_dim=8, seed=0):
+    rng = np.random.default_rng(seed)
+    X_f = rng.normal(size=(n_rows, input_dim))
+    X_o = rng.normal(size=(n_rows, input_dim))
+    ml_logit = rng.normal(size=n_rows)
+    y = (rng.uniform(size=n_rows) < expit(ml_logit + X_f[:, 0] - X_o[:, 0])).astype(float)
+    return X_f, X_o, y, ml_logit
+
+
+def predict(model, X_f, X_o, ml_logit):
+    with torch.no_grad():
+        return model(
+            torch.as_tensor(ml_logit, dtype=torch.float32).view(-1, 1),
+            torch.as_tensor(X_f, dtype=torch.float32),
+            torch.as_tensor(X_o, dtype=torch.float32),
+        ).numpy()[:, 0]
+
+
+def check_single_model(n_epochs=5, batch_size=64, lr=0.01):
+    X_f, X_o, y, ml_logit = make_data()
+    input_dim = X_f.shape[1]
+    for model, batched_model in [
+        (SymmetricModel(input_dim, 16, 16), BatchedSymmetricModel(1, input_dim, 16, 16)),
+        (NonSymmetricModel(input_dim, 16, 16, 16), BatchedNonSymmetricModel(1, input_dim, 16, 16, 16)),
+    ]:
+        copy_weights(model, batched_model)
+        torch.manual_seed(0)
+        adam_reference(model, X_f, X_o, y, ml_logit, lr, n_epochs, batch_size)
+        torch.manual_seed(0)
+        _train_batched(batched_model, [(X_f, X_o, y, ml_logit)], [lr], n_epochs, batch_size)
+        batched_y_hat = _predict_batched(batched_model, [(X_f, X_o, ml_logit)])[0]
+        max_abs_diff = np.abs(predict(model, X_f, X_o, ml_logit) - batched_y_hat).max()
+        assert max_abs_diff < 1e-4, max_abs_diff
+        print(f"{type(model).__name__}: batched engine vs torch.optim.Adam, "
+              f"max abs diff {max_abs_diff:.2e}")
+
+
+def check_several_models(n_epochs=5, batch_size=64, lrs=(0.01, 0.003, 0.03)):
+    # folds of different sizes, so the smaller ones run out of batches first
+    train_sets = [make_data(n_rows, seed=seed)
+                  for seed, n_rows in enumerate([1000, 600, 130])]
+    input_dim = train_sets[0][0].shape[1]
+    max_rows = max(len(y) for _, _, y, _ in train_sets)
+    models = [SymmetricModel(input_dim, 16, 16) for _ in train_sets]
+    batched_model = BatchedSymmetricModel(len(train_sets), input_dim, 16, 16)
+    for k, model in enumerate(models):
+        copy_weights(model, batched_model, k)
+    torch.manual_seed(0)
+    _train_batched(batched_model, train_sets, list(lrs), n_epochs, batch_size)
+    test_sets = [(X_f, X_o, ml_logit) for X_f, X_o, _, ml_logit in train_sets]
+    batched_y_hats = _predict_batched(batched_model, test_sets)
+    for k, (model, (X_f, X_o, y, ml_logit)) in enumerate(zip(models, train_sets)):
+        torch.manual_seed(0)
+        adam_reference(model, X_f, X_o, y, ml_logit, lrs[k], n_epochs, batch_size,
+                       n_models=len(train_sets), max_rows=max_rows, k=k)
+        max_abs_diff = np.abs(predict(model, X_f, X_o, ml_logit) - batched_y_hats[k]).max()
+        assert max_abs_diff < 1e-4, max_abs_diff
+        print(f"model {k} of {len(train_sets)} ({len(y)} rows, lr {lrs[k]}): "
+              f"batched engine vs torch.optim.Adam, max abs diff {max_abs_diff:.2e}")
+
+
+def time_folds(n_folds=5, n_rows=5000, n_feats=32):
+    rng = np.random.default_rng(0)
+    fighter_cols = [f"x{i}" for i in range(n_feats)]
+    opponent_cols = [f"x{i}_opp" for i in range(n_feats)]
+    df = pd.DataFrame(rng.normal(size=(n_rows, 2 * n_feats)), columns=fighter_cols + opponent_cols)
+    df["p_fighter_implied"] = expit(rng.normal(size=n_rows))
+    df["targetWin"] = (rng.uniform(size=n_rows) < df["p_fighter_implied"]).astype(int)
+    fold_ends = np.linspace(n_rows // 2, n_rows, n_folds + 1).astype(int)
+    train_dfs = [df.iloc[:start] for start in fold_ends[:-1]]
+    test_dfs = [df.iloc[start:end] for start, end in zip(fold_ends[:-1], fold_ends[1:])]
+    wrapper = SymmetricModelWrapper(fighter_cols, opponent_cols, n_epochs=10)
+
+    start = time.time()
+    for train_df, test_df in zip(train_dfs, test_dfs):
+        wrapper.fit_predict(train_df, test_df)
+    one_at_a_time = time.time() - start
+
+    start = time.time()
+    wrapper.fit_predict_batched(train_dfs, test_dfs)
+    batched = time.time() - start
+    print(f"{n_folds} folds: one at a time {one_at_a_time:.2f}s, "
+          f"batched {batched:.2f}s ({one_at_a_time / batched:.1f}x)")
+
+
+if __name__ == "__main__":
+    check_single_model()
+    check_several_models()
+    time_folds()
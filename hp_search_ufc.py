@@ -3,16 +3,26 @@ import pandas as pd
 import matplotlib.pyplot as plt
 import seaborn as sns
 from model.mma_features import PcaEloWrapper, BinaryEloWrapper, AccEloWrapper
+from model.feature_cache import FeatureCache
 from sklearn.metrics import log_loss
 from model.mma_log_reg_stan import SimpleSymmetricModel
 
 
 class HyperParamTester(object):
 
-    def __init__(self, model):
+    def __init__(self, model, feature_cache=None):
         self.df = self.prep_dataset()
         self.model = model
+        # on-disk cache of elo features, so repeated calls to test_hp only
+        # refit the wrappers whose alpha changed
+        if feature_cache is None:
+            feature_cache = FeatureCache()
+        self.feature_cache = feature_cache
         self.static_feat_df = self.get_static_feat_df()
+        # precomputed elo features, filled in by test_hp_range
+        self.acc_elo_feat_dfs = dict() # alpha --> df
+        self.pca_elo_feat_dfs = dict() # (alpha, n_pca) --> df
+        self.bin_elo_feat_dfs = dict() # alpha --> df
 
     def test_hp_range(self, n_draws_per_param):
         results = []
@@ -25,6 +35,16 @@ class HyperParamTester(object):
         binary_elo_alpha_vals = [0.4, 0.6, 0.8]
         acc_elo_alpha_vals = [0.4, 0.6, 0.8]
         n_pca_vals = [2, 3, 4]
+        # fit every alpha in the grid at once, rather than refitting each
+        # elo wrapper from scratch at every grid point
+        self.acc_elo_feat_dfs = self.get_acc_elo_dfs(acc_elo_alpha_vals)
+        self.bin_elo_feat_dfs = self.get_binary_elo_dfs(binary_elo_alpha_vals)
+        pca_elo_feat_dfs = self.get_pca_elo_dfs(pca_elo_alpha_vals, max(n_pca_vals))
+        self.pca_elo_feat_dfs = {
+            # PC_i doesn't depend on n_pca, so the largest n_pca covers them all
+            (alpha, n_pca): pca_elo_feat_dfs[alpha]
+            for alpha in pca_elo_alpha_vals for n_pca in n_pca_vals
+        }
         for pca_elo_alpha in pca_elo_alpha_vals:
             for binary_elo_alpha in binary_elo_alpha_vals:
                 for acc_elo_alpha in acc_elo_alpha_vals:
@@ -42,9 +62,15 @@ class HyperParamTester(object):
         return pd.DataFrame(results)
     
     def test_hp(self, pca_elo_alpha=0.5, binary_elo_alpha=0.5, acc_elo_alpha=0.5, n_pca=16):
-        acc_elo_feat_df = self.get_acc_elo_df(acc_elo_alpha)
-        pca_elo_feat_df = self.get_pca_elo_df(pca_elo_alpha, n_pca)
-        bin_elo_feat_df = self.get_binary_elo_df(binary_elo_alpha)
+        acc_elo_feat_df = self.acc_elo_feat_dfs.get(acc_elo_alpha)
+        if acc_elo_feat_df is None:
+            acc_elo_feat_df = self.get_acc_elo_df(acc_elo_alpha)
+        pca_elo_feat_df = self.pca_elo_feat_dfs.get((pca_elo_alpha, n_pca))
+        if pca_elo_feat_df is None:
+            pca_elo_feat_df = self.get_pca_elo_df(pca_elo_alpha, n_pca)
+        bin_elo_feat_df = self.bin_elo_feat_dfs.get(binary_elo_alpha)
+        if bin_elo_feat_df is None:
+            bin_elo_feat_df = self.get_binary_elo_df(binary_elo_alpha)
 
         feat_df = self.static_feat_df.merge(
             pca_elo_feat_df, on="espn_fight_id", how="left",
@@ -116,14 +142,15 @@ class HyperParamTester(object):
         }
 
     def get_pca_elo_df(self, elo_alpha, n_pca=16):
-        pca_ew = PcaEloWrapper(n_pca=n_pca, target_cols=self.diff_cols, alpha=elo_alpha)
+        pca_ew = PcaEloWrapper(n_pca=n_pca, target_cols=self.diff_cols, alpha=elo_alpha,
+                               feature_cache=self.feature_cache)
         keep_inds = self.df[self.diff_cols].notnull().all(1) | self.df["is_ufc"]
         pca_elo_feat_df = pca_ew.fit_transform_all(self.df.loc[keep_inds].reset_index(drop=True))
         return pca_elo_feat_df
 
     def get_binary_elo_df(self, elo_alpha):
         elo_alphas = {col: elo_alpha for col in self.bin_cols}
-        bin_ew = BinaryEloWrapper(elo_alphas)
+        bin_ew = BinaryEloWrapper(elo_alphas, feature_cache=self.feature_cache)
         bin_elo_feat_df = bin_ew.fit_transform_all(self.df)
         return bin_elo_feat_df
 
@@ -132,7 +159,7 @@ class HyperParamTester(object):
             (landed_col, attempted_col): elo_alpha 
             for landed_col, attempted_col in zip(self.landed_cols, self.attempted_cols)
         }
-        acc_ew = AccEloWrapper(elo_alphas)
+        acc_ew = AccEloWrapper(elo_alphas, feature_cache=self.feature_cache)
         subset_cols = self.landed_cols + self.attempted_cols
         subset_cols = [col+"_opp" for col in subset_cols] + subset_cols
         keep_inds = self.df[subset_cols].notnull().all(1) | self.df["is_ufc"]
@@ -140,6 +167,31 @@ class HyperParamTester(object):
         print(acc_elo_feat_df.isnull().mean())
         return acc_elo_feat_df
 
+    def get_pca_elo_dfs(self, elo_alpha_vals, n_pca=16):
+        # alpha doesn't matter here, fit_transform_alpha_grid overrides it
+        pca_ew = PcaEloWrapper(n_pca=n_pca, target_cols=self.diff_cols, alpha=elo_alpha_vals[0])
+        keep_inds = self.df[self.diff_cols].notnull().all(1) | self.df["is_ufc"]
+        return pca_ew.fit_transform_alpha_grid(
+            self.df.loc[keep_inds].reset_index(drop=True), elo_alpha_vals
+        )
+
+    def get_binary_elo_dfs(self, elo_alpha_vals):
+        bin_ew = BinaryEloWrapper({col: elo_alpha_vals[0] for col in self.bin_cols})
+        return bin_ew.fit_transform_alpha_grid(self.df, elo_alpha_vals)
+
+    def get_acc_elo_dfs(self, elo_alpha_vals):
+        elo_alphas = {
+            (landed_col, attempted_col): elo_alpha_vals[0]
+            for landed_col, attempted_col in zip(self.landed_cols, self.attempted_cols)
+        }
+        acc_ew = AccEloWrapper(elo_alphas)
+        subset_cols = self.landed_cols + self.attempted_cols
+        subset_cols = [col+"_opp" for col in subset_cols] + subset_cols
+        keep_inds = self.df[subset_cols].notnull().all(1) | self.df["is_ufc"]
+        return acc_ew.fit_transform_alpha_grid(
+            self.df.loc[keep_inds].reset_index(drop=True), elo_alpha_vals
+        )
+
     def get_static_feat_df(self):
         # pca_elo_feat_df.shape, df.shape
         feat_df = self.df.dropna(subset=["p_fighter_open_implied"]).copy()
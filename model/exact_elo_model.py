@@ -4,99 +4,472 @@ So let's just do logistic regression, or linear regression,
 to infer fighter skill(s) from fight outcomes (depending on the skill type).
 """
 
+import os
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 import seaborn as sns
 from tqdm import tqdm 
 from sklearn.metrics import log_loss, accuracy_score, mean_squared_error, mean_absolute_error
-from sklearn.preprocessing import OneHotEncoder
 from scipy.special import expit, logit
 from abc import ABC, abstractmethod
-from model.mma_elo_model import BaseEloEstimator
-from sklearn.linear_model import LinearRegression, LogisticRegression, Ridge
+from model.mma_elo_model import BaseEloEstimator, _expit_matchup_matrix
+from model.fighter_index import FighterIndex
+from sklearn.linear_model import LinearRegression, Ridge
 from scipy.sparse import csr_matrix, hstack
-# from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+from itertools import repeat
 from joblib import Parallel, delayed
 
 unknown_fighter_id = "2557037" # "2557037/unknown-fighter"
 
+def _solve_ridge_pcg(xtwx, xtwy, reg_penalty, x0, rtol=1e-10, max_iter=1000):
+    """
+    Solve (xtwx + reg_penalty * I) x = xtwy by conjugate gradients with a
+    Jacobi preconditioner, starting from x0. A direct sparse solve is much
+    slower here: the fighter-opponent graph is well connected, so the
+    factorization fills in.
+    xtwy and x0 may also be (n_features, n_outputs), to solve for several
+    right-hand sides at once. Each column then gets its own CG iteration,
+    but they share every sparse matmul with xtwx.
+    Returns (x, n_iter).
+    """
+    return _pcg(lambda v: xtwx @ v + reg_penalty * v, xtwy,
+                1 / (xtwx.diagonal() + reg_penalty), x0, rtol=rtol, max_iter=max_iter)
+
+def _pcg(matvec, b, inv_diag, x0, rtol=1e-10, max_iter=1000):
+    """
+    Solve A x = b by conjugate gradients, for symmetric positive definite A,
+    given only matvec(v) = A @ v and the inverse of A's diagonal.
+    b and x0 may be (n, n_outputs). See _solve_ridge_pcg.
+    Returns (x, n_iter).
+    """
+    if b.ndim == 2:
+        inv_diag = inv_diag[:, None]
+    x = x0.copy()
+    r = b - matvec(x)
+    z = inv_diag * r
+    p = z.copy()
+    rz = np.sum(r * z, axis=0)
+    b_norm = np.linalg.norm(b, axis=0)
+    for n_iter in range(max_iter):
+        # columns that have converged stop moving
+        is_active = np.linalg.norm(r, axis=0) > rtol * b_norm
+        if not np.any(is_active):
+            break
+        Ap = matvec(p)
+        step = np.where(is_active, rz / np.where(is_active, np.sum(p * Ap, axis=0), 1), 0)
+        x += step * p
+        r -= step * Ap
+        z = inv_diag * r
+        rz_new = np.sum(r * z, axis=0)
+        p = z + np.where(is_active, rz_new / np.where(is_active, rz, 1), 0) * p
+        rz = rz_new
+    return x, n_iter
+
+def _solve_logistic_newton_cg(X, y, sample_weights, reg_penalty, x0, gtol=1e-6, cg_rtol=1e-4,
+                              max_iter=100):
+    """
+    Minimize sum(w * log_loss(y, expit(X @ x))) + 0.5 * reg_penalty * ||x||^2
+    by Newton's method, starting from x0. Each Newton step is solved by _pcg,
+    with Hessian-vector products X^T diag(w * p * (1-p)) X v taken straight
+    from the sparse X, so X^T W X is never formed. Newton's method converges
+    quadratically near the solution, so from a good warm start it only
+    takes a step or two.
+    Returns (x, n_iter), where n_iter is the number of Newton steps.
+    """
+    def get_loss(z, x):
+        return np.sum(sample_weights * (np.logaddexp(0, z) - y * z)) + 0.5 * reg_penalty * (x @ x)
+
+    # for the diagonal of the Hessian, X^T diag(curv) X
+    X_sq = X.multiply(X).tocsr()
+    x = x0.copy()
+    z = X @ x
+    loss = get_loss(z, x)
+    for n_iter in range(max_iter):
+        p = expit(z)
+        grad = X.T @ (sample_weights * (p - y)) + reg_penalty * x
+        if np.max(np.abs(grad), initial=0) <= gtol:
+            break
+        curv = sample_weights * p * (1 - p)
+        # CG is cheap next to a Newton step, so solve for the step fairly
+        # accurately. Looser tolerances take more Newton steps, and lose
+        # most of the benefit of the warm start
+        step, _ = _pcg(lambda v: X.T @ (curv * (X @ v)) + reg_penalty * v, -grad,
+                       1 / (X_sq.T @ curv + reg_penalty), np.zeros_like(x),
+                       rtol=cg_rtol, max_iter=len(x))
+        # backtracking line search. The full step is almost always accepted
+        X_step = X @ step
+        slope = grad @ step
+        step_size = 1.0
+        while True:
+            new_z, new_x = z + step_size * X_step, x + step_size * step
+            new_loss = get_loss(new_z, new_x)
+            if new_loss <= loss + 1e-4 * step_size * slope or step_size < 1e-10:
+                break
+            step_size *= 0.5
+        x, z, loss = new_x, new_z, new_loss
+    return x, n_iter
+
+def _to_shared_memory(arrays:dict):
+    """
+    Copy each of the arrays into its own block of shared memory.
+    Returns (shm_list, specs), where specs maps each key to the
+    (shm name, shape, dtype) needed to attach to it, and is cheap to pickle.
+    The caller must close() and unlink() everything in shm_list when done.
+    """
+    shm_list, specs = [], dict()
+    for key, arr in arrays.items():
+        arr = np.ascontiguousarray(arr)
+        shm = SharedMemory(create=True, size=max(arr.nbytes, 1))
+        np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf)[...] = arr
+        shm_list.append(shm)
+        specs[key] = (shm.name, arr.shape, arr.dtype)
+    return shm_list, specs
+
+def _fit_transform_all_helper(estimator, specs, shape, date_range):
+    """
+    Runs estimator._walk_forward_exact on one shard of dates, in a worker
+    process. The design matrix and the other arrays are read straight out of
+    the shared memory described by specs (see _to_shared_memory).
+    Module-level so that ProcessPoolExecutor can send it to worker processes.
+    Returns (preds, n_iters, coef, linear_model), the last two being the fit
+    for the shard's last date.
+    """
+    shm_list = [SharedMemory(name=name) for name, _, _ in specs.values()]
+    arrays = {
+        key: np.ndarray(arr_shape, dtype=dtype, buffer=shm.buf)
+        for shm, (key, (_, arr_shape, dtype)) in zip(shm_list, specs.items())
+    }
+    X = csr_matrix((arrays["data"], arrays["indices"], arrays["indptr"]), shape=shape, copy=False)
+    preds = estimator._walk_forward_exact(X, arrays["y"], arrays["is_obs"], arrays["dt_vec"],
+                                          arrays["log_w"], date_range)
+    # the shared memory can't be closed while any arrays still point into it
+    del X, arrays
+    for shm in shm_list:
+        shm.close()
+    return preds, estimator.n_iters, estimator._coef, estimator._linear_model
+
 class BaseFighterPowerEstimator(ABC):
     """
     Abstract base class for all exact elo estimators
     """
 
-    def __init__(self, target_col, weight_decay=0.01, reg_penalty=10, static_feat_cols=None):
+    def __init__(self, target_col, weight_decay=0.01, reg_penalty=10, static_feat_cols=None,
+                 journeyman_min_fights=2):
+        """
+        journeyman_min_fights: with fast=True, fighters with fewer than this
+            many previous fights share a single "journeyman" column.
+            See fit_journeyman_collapse.
+        """
         self.target_col = target_col
         self.weight_decay = weight_decay
         self.reg_penalty = reg_penalty
         if static_feat_cols is None:
             static_feat_cols = []
         self.static_feat_cols = static_feat_cols
-        self.fighter_ids = None
-        self._fighter_encoder = None
+        self.journeyman_min_fights = journeyman_min_fights
+        # FighterIndex, possibly shared with other estimators
+        self.fighter_index = None
         self.elo_feature_df = None
+        # date of each fighter's journeyman_min_fights-th fight, if fast=True
+        self._graduation_dates = None
 
         self._linear_model = None
+        # coefficients of the most recent fit
+        self._coef = None
+        # solver iterations for each date of the last walk-forward, if the
+        # solver reports them
+        self.n_iters = []
 
-    def fit_fighter_encoder(self, df: pd.DataFrame, fast=False):
+    def fit_fighter_encoder(self, df: pd.DataFrame):
         assert (df["fight_id"].value_counts() == 2).all()
-        if fast:
-            fighter_counts = df["FighterID_espn"].value_counts()
-            # this may introduce data leakage - we don't know whether the fighter will fight again in the future
-            fighter_ids = fighter_ids.map(lambda x: x if fighter_counts[x] > 1 else "journeyman")
-        self.fighter_ids = sorted(df["FighterID_espn"])
-        self._fighter_encoder = OneHotEncoder(handle_unknown="ignore")
-        self._fighter_encoder.fit(np.array(self.fighter_ids).reshape(-1,1))
+        if self.fighter_index is None:
+            self.fighter_index = FighterIndex()
+        # a shared index may already have these fighters, and more
+        self.fighter_index.add(df["FighterID_espn"])
 
     def extract_features(self, df: pd.DataFrame):
         """
         Extract features from the dataframe, possibly including static features
         """
         X = (
-            self._fighter_encoder.transform(df["FighterID_espn"].values.reshape(-1,1)) - 
-            self._fighter_encoder.transform(df["OpponentID_espn"].values.reshape(-1,1))
+            self.fighter_index.one_hot(df["FighterID_espn"]) -
+            self.fighter_index.one_hot(df["OpponentID_espn"])
         )
         if len(self.static_feat_cols) > 0:
             X_extra = df[self.static_feat_cols].values
             X = hstack([X, X_extra])
         return X
 
-    def fit_transform_all(self, df, min_date=None, fast=False):
+    def get_design_matrix(self, df: pd.DataFrame):
+        """
+        Fit the fighter encoder on df, and return the CSR design matrix for df.
+        Doesn't depend on the target, so it can be shared by the estimators
+        for several targets (see BaseFighterPowerWrapper).
+        """
+        self.fit_fighter_encoder(df)
+        return self.extract_features(df).tocsr()
+
+    def fit_journeyman_collapse(self, df: pd.DataFrame):
+        """
+        Find the date of each fighter's journeyman_min_fights-th fight in df.
+        When predicting the fights on date d, fighters with fewer than
+        journeyman_min_fights fights before d all share one "journeyman"
+        column, in the training rows as well as the test rows (see
+        get_collapsed_columns). Whether a fighter has their own column only
+        depends on the fights before d, so there's no leakage, and most
+        fighters with a single fight never get a column at all.
+        """
+        fighter_df = df[["FighterID_espn", "Date"]].iloc[np.argsort(df["Date"].values, kind="stable")]
+        # the data is doubled, so each fighter has one FighterID_espn row per fight
+        nth_fight_df = fighter_df.loc[
+            fighter_df.groupby("FighterID_espn").cumcount() == self.journeyman_min_fights - 1
+        ]
+        self._graduation_dates = np.full(len(self.fighter_index), np.datetime64("NaT"),
+                                         dtype="datetime64[ns]")
+        self._graduation_dates[self.fighter_index.get_inds(nth_fight_df["FighterID_espn"])] = \
+            nth_fight_df["Date"].values
+
+    def get_collapsed_columns(self, date, n_features):
+        """
+        Maps each of the n_features columns of the design matrix to a column
+        of the smaller matrix used to predict the fights on date.
+        Fighters who had journeyman_min_fights fights before date keep their
+        own columns, then comes the shared journeyman column, then the static
+        features. Fighters who haven't had that many fights have a graduation
+        date of NaT, which never compares less than date.
+        Returns (col_map, n_collapsed).
+        """
+        n_static = len(self.static_feat_cols)
+        is_regular = self._graduation_dates[:n_features - n_static] < date
+        n_regular = np.sum(is_regular)
+        col_map = np.full(len(is_regular), n_regular)
+        col_map[is_regular] = np.arange(n_regular)
+        col_map = np.concatenate([col_map, n_regular + 1 + np.arange(n_static)])
+        return col_map, n_regular + 1 + n_static
+
+    @staticmethod
+    def collapse_columns(X:csr_matrix, col_map, n_collapsed) -> csr_matrix:
+        """
+        Sum the columns of X that col_map sends to the same place. Just
+        relabels the nonzeros, so it's O(nnz) and never forms a product.
+        """
+        X = csr_matrix((X.data, col_map[X.indices], X.indptr), shape=(X.shape[0], n_collapsed))
+        # two journeymen fighting each other cancel out
+        X.sum_duplicates()
+        return X
+
+    def fit_transform_all(self, df, min_date=None, fast=False, incremental=False, X=None,
+                          n_jobs=1):
         """
         For each date d starting from min_date, fit the model on all data prior to d,
         and predict the outcome of all fights on date d.
         Return a dataframe with the same number of rows as df.query("Date > {min_date}")
+        fast: if True, each date's fit collapses the fighters with few previous
+            fights into a single column, which shrinks the problem a lot.
+            See fit_journeyman_collapse. Raises a ValueError together with
+            incremental=True.
+        incremental: if True, warm-start each date's fit from the previous date's
+            coefficients, instead of refitting from scratch. Agrees with the
+            exact per-date fits up to the solver tolerance.
+        X: precomputed get_design_matrix(df), with rows lined up with df.
+            Only read, never modified. self.fighter_index must be the one
+            it was built with.
+        n_jobs: number of processes to split the dates between, for the
+            exact (not incremental) fits. -1 means one per CPU.
         """
+        if fast and incremental:
+            # the collapsed columns change from date to date, which doesn't
+            # fit with carrying X^T W X from one date to the next
+            raise ValueError("fast=True can't be combined with incremental=True")
         assert (df["fight_id"].value_counts() == 2).all()
         if min_date is None:
             min_date = df["Date"].min()
-        date_range = sorted(df["Date"].loc[df["Date"] > min_date].unique())
-        pred_df = []
-        self.fit_fighter_encoder(df, fast=fast)
-        self.init_linear_model(df)
-        X = self.extract_features(df).tocsr()
-        y = df[self.target_col]
-        dt_vec = df["Date"]
-        log_w = np.log(1 - self.weight_decay) * (df["Date"].max() - df["Date"]).dt.days / 30.5
-        for date in tqdm(date_range):
-            train_inds = (dt_vec < date) & y.notnull()
+        if incremental:
+            return self._fit_transform_all_incremental(df, min_date=min_date, X=X)
+        if X is None:
+            X = self.get_design_matrix(df)
+        self._graduation_dates = None
+        if fast:
+            self.fit_journeyman_collapse(df)
+        dt_vec = df["Date"].values
+        log_w = self.get_log_weights(df)
+        date_range = np.unique(dt_vec[(df["Date"] > min_date).values])
+        y = df[self.target_col].values.astype(float)
+        preds = self._walk_forward_exact_parallel(X, y, ~np.isnan(y), dt_vec, log_w,
+                                                  date_range, n_jobs=n_jobs)
+        # the predictions are sorted by date, and by order in df within each date
+        test_rows = np.flatnonzero((df["Date"] > min_date).values)
+        test_rows = test_rows[np.argsort(dt_vec[test_rows], kind="stable")]
+        pred_df = df.iloc[test_rows][["fight_id", "FighterID_espn", "OpponentID_espn",
+                                      self.target_col]].assign(
+            pred_elo_target=preds
+        )
+        return pred_df.reset_index(drop=True)
+
+    def _walk_forward_exact(self, X, y, is_obs, dt_vec, log_w, date_range):
+        """
+        The date loop of fit_transform_all: for each date in date_range, refit
+        from scratch on the observed rows before it, and predict the rows on it.
+        y may be (n_rows, n_outputs) if the model supports it, with is_obs
+        marking the rows to train on.
+        Returns the predictions for each date in date_range, stacked.
+        """
+        self.init_linear_model(None)
+        self.n_iters = []
+        pred_list = []
+        pbar = tqdm(date_range)
+        for date in pbar:
+            train_inds = (dt_vec < date) & is_obs
             test_inds = dt_vec == date
-            X_train, y_train = X[train_inds, :], y[train_inds]
-            X_test = X[test_inds, :]
+            X_train, X_test = X[train_inds], X[test_inds]
+            if self._graduation_dates is not None:
+                col_map, n_collapsed = self.get_collapsed_columns(date, X.shape[1])
+                X_train = self.collapse_columns(X_train, col_map, n_collapsed)
+                X_test = self.collapse_columns(X_test, col_map, n_collapsed)
+                if self._coef is not None and self._coef.ndim == 1:
+                    # each collapsed column starts from the average of the
+                    # columns it stands for
+                    self.set_warm_start(
+                        np.bincount(col_map, weights=self._coef, minlength=n_collapsed) /
+                        np.maximum(np.bincount(col_map, minlength=n_collapsed), 1)
+                    )
             w_train = np.exp(log_w[train_inds] - log_w[train_inds].max())
-            self.fit_linear_model(X_train, y_train, sample_weights=w_train)
-            pred_df.append(
-                df.loc[test_inds, ["fight_id", "FighterID_espn", "OpponentID_espn",
-                                      self.target_col]].assign(
-                    pred_elo_target=self.predict_linear_model(X_test)
-                                      )
-            )
-        pred_df = pd.concat(pred_df).reset_index(drop=True)
-        return pred_df
+            self.fit_linear_model(X_train, y[train_inds], sample_weights=w_train)
+            pred_list.append(self.predict_linear_model(X_test))
+            if self._graduation_dates is not None:
+                # back to one coefficient per column of X
+                self._coef = self._coef[col_map]
+            if len(self.n_iters) > 0:
+                pbar.set_postfix(n_iter=self.n_iters[-1])
+        return np.concatenate(pred_list)
+
+    def set_warm_start(self, coef):
+        """
+        Start the next fit_linear_model from coef, if the linear model
+        warm-starts at all.
+        """
+        pass
+
+    def _walk_forward_exact_parallel(self, X, y, is_obs, dt_vec, log_w, date_range, n_jobs=1):
+        """
+        Same as _walk_forward_exact, but date_range is split into n_jobs
+        contiguous shards, which are fit in separate processes. The arrays are
+        put in shared memory once, rather than pickled for every worker, and
+        the shards' predictions are put back together in date order. So the
+        result doesn't depend on n_jobs, except that solvers that warm-start
+        from the previous date restart at each shard boundary. Afterwards, the
+        fitted model is the last shard's, ie the fit for the last date, same
+        as after _walk_forward_exact.
+        """
+        if n_jobs < 0:
+            n_jobs = os.cpu_count() + 1 + n_jobs
+        if n_jobs == 1 or len(date_range) <= 1:
+            return self._walk_forward_exact(X, y, is_obs, dt_vec, log_w, date_range)
+        # later dates have more training data, so balance the shards by
+        # the number of training rows rather than the number of dates
+        work = np.cumsum(np.searchsorted(np.sort(dt_vec[is_obs]), date_range) + 1)
+        shard_ends = np.searchsorted(work, work[-1] * np.arange(1, n_jobs) / n_jobs)
+        shards = [shard for shard in np.split(date_range, shard_ends) if len(shard) > 0]
+        X = csr_matrix(X)
+        shm_list, specs = _to_shared_memory({
+            "data": X.data, "indices": X.indices, "indptr": X.indptr,
+            "y": y, "is_obs": is_obs, "dt_vec": dt_vec, "log_w": log_w,
+        })
+        try:
+            with ProcessPoolExecutor(max_workers=len(shards)) as executor:
+                # map returns the results in the order of the shards
+                results = list(executor.map(_fit_transform_all_helper, repeat(self),
+                                            repeat(specs), repeat(X.shape), shards))
+        finally:
+            for shm in shm_list:
+                shm.close()
+                shm.unlink()
+        self.n_iters = [n_iter for _, n_iters, _, _ in results for n_iter in n_iters]
+        _, _, self._coef, self._linear_model = results[-1]
+        return np.concatenate([preds for preds, _, _, _ in results])
     
+    def _fit_transform_all_incremental(self, df, min_date, X=None):
+        """
+        Same as fit_transform_all, but the data is sorted by date once, so that
+        the training data for each date is a prefix of the observed rows, and
+        each date's fit starts from the previous date's coefficients.
+        """
+        # stable sort, so fights on the same date keep their order in df,
+        # just like df.loc[test_inds] in fit_transform_all
+        date_order = np.argsort(df["Date"].values, kind="stable")
+        df = df.iloc[date_order]
+        if X is None:
+            X = self.get_design_matrix(df)
+        elif (np.diff(date_order) != 1).any():
+            # don't copy a shared X unless we have to
+            X = X[date_order]
+        dt_vec = df["Date"].values
+        log_w = self.get_log_weights(df)
+        date_range = np.unique(dt_vec[(df["Date"] > min_date).values])
+        y = df[self.target_col].values.astype(float)
+        preds = self._walk_forward_incremental(X, y, ~np.isnan(y), dt_vec, log_w, date_range)
+        test_start = np.searchsorted(dt_vec, date_range[0], side="left")
+        pred_df = df.iloc[test_start:][["fight_id", "FighterID_espn", "OpponentID_espn",
+                                        self.target_col]].assign(
+            pred_elo_target=preds
+        )
+        return pred_df.reset_index(drop=True)
+
+    def get_log_weights(self, df):
+        # log sample weights, decaying geometrically with the months since each fight
+        return (np.log(1 - self.weight_decay) * (df["Date"].max() - df["Date"]).dt.days / 30.5).values
+
+    def _walk_forward_incremental(self, X, y, is_obs, dt_vec, log_w, date_range):
+        """
+        The date loop of _fit_transform_all_incremental, on arrays whose rows
+        are sorted by date. y may be (n_rows, n_outputs) if the model supports
+        it, with is_obs marking the rows to train on.
+        Returns the predictions for every row from date_range[0] on.
+        """
+        X_obs, y_obs, log_w_obs = X[is_obs], y[is_obs], log_w[is_obs]
+        # rows [test_starts[i], test_ends[i]) are the fights on date_range[i],
+        # and the first n_trains[i] observed rows are the fights before it
+        test_starts = np.searchsorted(dt_vec, date_range, side="left")
+        test_ends = np.searchsorted(dt_vec, date_range, side="right")
+        n_trains = np.searchsorted(dt_vec[is_obs], date_range, side="left")
+        self.init_incremental_fit(X.shape[1], y.shape[1:])
+        self.n_iters = []
+        pred_list = []
+        pbar = tqdm(zip(n_trains, test_starts, test_ends), total=len(date_range))
+        for n_train, test_start, test_end in pbar:
+            coef = self.fit_incremental(X_obs, y_obs, log_w_obs, n_train)
+            pred_list.append(self.predict_given_coef(X[test_start:test_end], coef))
+            if len(self.n_iters) > 0:
+                pbar.set_postfix(n_iter=self.n_iters[-1])
+        return np.concatenate(pred_list)
+
+    def init_incremental_fit(self, n_features, output_shape=()):
+        """
+        Reset any state that fit_incremental carries from one date to the next.
+        output_shape: (n_outputs,) when fitting several targets at once.
+        """
+        self._coef = np.zeros((n_features,) + tuple(output_shape))
+
+    def fit_incremental(self, X_obs, y_obs, log_w_obs, n_train):
+        """
+        Fit the model on the first n_train rows of X_obs, y_obs, which are
+        sorted by date. Each call has n_train at least as large as the last.
+        Returns the fitted coefficients.
+        """
+        raise NotImplementedError()
+
+    def predict_given_coef(self, X, coef):
+        # logistic regression will have to override this
+        return X @ coef
+
     def fit_linear_model(self, X, y, sample_weights=None):
-        return self._linear_model.fit(X, y, sample_weight=sample_weights)
+        self._linear_model.fit(X, y, sample_weight=sample_weights)
+        # (n_features,), or (n_features, n_outputs) for a multi-output Ridge
+        self._coef = np.squeeze(self._linear_model.coef_.T)
+        return self._linear_model
     
     def predict_linear_model(self, X):
         # logistic regression will have to override this
@@ -118,23 +491,70 @@ class BaseFighterPowerEstimator(ABC):
 
 
 class BinaryFighterPowerEstimator(BaseFighterPowerEstimator):
+    """
+    Predict some binary outcome, eg whether the fighter wins.
+    The L2-penalized logistic regression is fit by _solve_logistic_newton_cg.
+    Each fit starts from the last one's coefficients, and consecutive dates
+    have nearly the same solution, so it only takes a few Newton steps.
+    """
 
     def init_linear_model(self, df: pd.DataFrame):
-        self._linear_model = LogisticRegression(
-            penalty="l2", max_iter=1000,
-            C=1/self.reg_penalty, # inverse of regularization strength
-            fit_intercept=False,
-            warm_start=True,
-            # warm_start=False,
-            solver="lbfgs",
-            n_jobs=-1
-        )
+        # there's no sklearn model, fit_linear_model calls _solve_logistic_newton_cg itself
+        self._linear_model = None
+        self._coef = None
+
+    def fit_linear_model(self, X, y, sample_weights=None):
+        if sample_weights is None:
+            sample_weights = np.ones(X.shape[0])
+        coef = self._coef
+        if coef is None or len(coef) != X.shape[1]:
+            coef = np.zeros(X.shape[1])
+        self._coef = self.fit_linear_model_warm(X, np.asarray(y, dtype=float),
+                                                np.asarray(sample_weights), coef)
 
     def predict_linear_model(self, X: np.ndarray) -> np.ndarray:
         """
         Predict the outcome of a fight between fighter_ids and opponent_ids
         """
-        return self._linear_model.predict_proba(X)[:,1]
+        return self.predict_given_coef(X, self._coef)
+
+    def set_warm_start(self, coef):
+        self._coef = coef
+
+    def fit_incremental(self, X_obs, y_obs, log_w_obs, n_train):
+        X_train, y_train = X_obs[:n_train], y_obs[:n_train]
+        # rows are sorted by date, so the most recent training fight has the
+        # largest log weight, and gets weight 1 just like in the exact fit
+        w_train = np.exp(log_w_obs[:n_train] - log_w_obs[n_train-1])
+        self._coef = self.fit_linear_model_warm(X_train, y_train, w_train, self._coef)
+        return self._coef
+
+    def fit_linear_model_warm(self, X, y, sample_weights, coef):
+        """
+        Minimize the L2-penalized, weighted log loss by Newton-CG, starting
+        from coef. Returns the new coefficients.
+        """
+        coef, n_iter = _solve_logistic_newton_cg(csr_matrix(X), y, sample_weights,
+                                                 self.reg_penalty, coef)
+        self.n_iters.append(n_iter)
+        return coef
+
+    def predict_given_coef(self, X, coef):
+        return expit(X @ coef)
+
+    def predict_matchup_matrix(self, fighter_ids, out_path=None):
+        """
+        (n, n) matrix whose [i, j] entry is the probability that
+        fighter_ids[i] beats fighter_ids[j], according to the most recent fit
+        (eg the last date of fit_transform_all). Static features are taken
+        to be 0, and fighters the model wasn't fit on have a power of 0.
+        out_path: if given, write the matrix to a float32 .npy memmap there.
+        """
+        # the fighter powers come first, then the static features
+        # (see extract_features)
+        fighter_coef = self._coef[:len(self._coef) - len(self.static_feat_cols)]
+        fighter_powers = self.fighter_index.get_powers(pd.Series(fighter_ids), fighter_coef)
+        return _expit_matchup_matrix(fighter_powers, fighter_powers, out_path=out_path)
     
 class RealFighterPowerEstimator(BaseFighterPowerEstimator):
     """
@@ -148,4 +568,115 @@ class RealFighterPowerEstimator(BaseFighterPowerEstimator):
             # Ridge doesn't accept warm_start. It's usually 
             # solved with a linear eqn solver, not gradient descent
             # so it's not a big deal
-        )
\ No newline at end of file
+        )
+
+    def init_incremental_fit(self, n_features, output_shape=()):
+        super().init_incremental_fit(n_features, output_shape)
+        # sufficient statistics X^T W X and X^T W y of the first self._n_seen
+        # observed rows, with the absolute weights exp(log_w). These never
+        # need rescaling, see fit_incremental
+        self._xtwx = csr_matrix((n_features, n_features))
+        self._xtwy = np.zeros((n_features,) + tuple(output_shape))
+        self._n_seen = 0
+
+    def fit_incremental(self, X_obs, y_obs, log_w_obs, n_train):
+        """
+        Rather than refitting, add the rows that are new since the last date
+        to the sufficient statistics, then solve the normal equations.
+        The weights relative to the most recent training row are
+        exp(log_w) / c, with c = exp(log_w_obs[n_train-1]). So with the
+        absolute-weight statistics A = X^T W X and b = X^T W y, the ridge
+        solution solves (A + reg_penalty * c * I) coef = b, and old rows
+        never need to be rescaled as time moves forward.
+        Each date costs O(nnz of the new rows) to form their outer products,
+        one sparse add to merge them into A, plus a warm-started sparse solve.
+        """
+        if n_train == self._n_seen:
+            # no new training data, so the fit can't change
+            self.n_iters.append(0)
+            return self._coef
+        X_new = X_obs[self._n_seen:n_train]
+        w_new = np.exp(log_w_obs[self._n_seen:n_train])
+        xtw_new = X_new.T.multiply(w_new).tocsr()
+        self._xtwx = self._xtwx + (xtw_new @ X_new)
+        # y_obs may have several columns, which all share X^T W X
+        self._xtwy += xtw_new @ y_obs[self._n_seen:n_train]
+        self._n_seen = n_train
+        scale = np.exp(log_w_obs[n_train-1])
+        # warm start from the previous date's solution, which is very close
+        self._coef, n_iter = _solve_ridge_pcg(self._xtwx, self._xtwy,
+                                              self.reg_penalty * scale, self._coef)
+        self.n_iters.append(n_iter)
+        return self._coef
+
+class MultiRealFighterPowerEstimator(RealFighterPowerEstimator):
+    """
+    RealFighterPowerEstimator for several targets at once. The targets share
+    the design matrix and sample weights, so for each date, X^T W X is built
+    once and every target's ridge problem is solved against it together.
+    Targets can have different missing rows, so they're grouped by which rows
+    are observed, and each group is fit on its own rows. Gives the same
+    predictions as fitting a RealFighterPowerEstimator for each target.
+    """
+
+    def __init__(self, target_cols, weight_decay=0.01, reg_penalty=10, static_feat_cols=None,
+                 journeyman_min_fights=2):
+        super().__init__(None, weight_decay=weight_decay, reg_penalty=reg_penalty,
+                         static_feat_cols=static_feat_cols,
+                         journeyman_min_fights=journeyman_min_fights)
+        self.target_cols = list(target_cols)
+
+    def get_target_groups(self, df):
+        """
+        Group the target_cols by their missing-value masks in df.
+        Returns a list of (target_cols, is_obs) pairs.
+        """
+        is_obs = df[self.target_cols].notnull().values
+        masks, group_ids = np.unique(is_obs.T, axis=0, return_inverse=True)
+        group_ids = np.ravel(group_ids)
+        return [
+            ([col for col, group_id in zip(self.target_cols, group_ids) if group_id == i], mask)
+            for i, mask in enumerate(masks)
+        ]
+
+    def fit_transform_all(self, df, min_date=None, fast=False, incremental=False, X=None,
+                          n_jobs=1):
+        """
+        Same as RealFighterPowerEstimator.fit_transform_all, but returns the
+        columns target_col, pred_{target_col} for each of the target_cols.
+        """
+        if fast and incremental:
+            raise ValueError("fast=True can't be combined with incremental=True")
+        assert (df["fight_id"].value_counts() == 2).all()
+        if min_date is None:
+            min_date = df["Date"].min()
+        date_order = np.argsort(df["Date"].values, kind="stable")
+        df = df.iloc[date_order]
+        if X is None:
+            X = self.get_design_matrix(df)
+        elif (np.diff(date_order) != 1).any():
+            X = X[date_order]
+        self._graduation_dates = None
+        if fast:
+            self.fit_journeyman_collapse(df)
+        dt_vec = df["Date"].values
+        log_w = self.get_log_weights(df)
+        date_range = np.unique(dt_vec[(df["Date"] > min_date).values])
+        test_start = np.searchsorted(dt_vec, date_range[0], side="left")
+        pred_df = df.iloc[test_start:][["fight_id", "FighterID_espn", "OpponentID_espn"]]
+        preds = dict()
+        for target_cols, is_obs in self.get_target_groups(df):
+            Y = df[target_cols].values.astype(float)
+            if incremental:
+                group_preds = self._walk_forward_incremental(X, Y, is_obs, dt_vec, log_w, date_range)
+            else:
+                group_preds = self._walk_forward_exact_parallel(X, Y, is_obs, dt_vec, log_w,
+                                                                date_range, n_jobs=n_jobs)
+            for target_col, target_preds in zip(target_cols, group_preds.T):
+                preds[target_col] = target_preds
+        for target_col in self.target_cols:
+            pred_df = pred_df.assign(**{
+                target_col: df[target_col].values[test_start:],
+                f"pred_{target_col}": preds[target_col],
+            })
+        return pred_df.reset_index(drop=True)
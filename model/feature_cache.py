@@ -0,0 +1,124 @@
+"""
+A content-addressed, on-disk cache for elo features.
+
+Entries are keyed by a hash of the input dataframe plus the wrapper's
+parameters (see BaseEloWrapper.get_cache_params), so refitting a wrapper on
+the same data with the same parameters just reads the features back from disk.
+The cache doesn't know about code changes - clear() it after changing an
+estimator.
+
+Example:
+    cache = FeatureCache(max_bytes=2**30)
+    bin_ew = BinaryEloWrapper({"win_target": 0.5}, feature_cache=cache)
+    elo_feat_df = bin_ew.fit_transform_all(df) # miss, fits and writes to disk
+    elo_feat_df = bin_ew.fit_transform_all(df) # hit, reads from disk
+    print(cache.n_hits, cache.n_misses)
+"""
+
+import os
+import pickle
+import hashlib
+import pandas as pd
+from db import HOME_DIR
+
+
+class FeatureCache(object):
+
+    def __init__(self, cache_dir=None, max_bytes=2**30):
+        """
+        cache_dir: directory to write entries to. Defaults to feature_cache/
+            in the root of the project.
+        max_bytes: once the entries take up more than this many bytes, the
+            least recently used ones are deleted.
+        """
+        if cache_dir is None:
+            cache_dir = f"{HOME_DIR}/feature_cache"
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.n_hits = 0
+        self.n_misses = 0
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def hash_df(df:pd.DataFrame) -> str:
+        """
+        Fingerprint of the contents of df, including the index, column names
+        and dtypes.
+        """
+        h = hashlib.md5()
+        h.update(pd.util.hash_pandas_object(df, index=True).values.tobytes())
+        h.update(repr(list(zip(df.columns, df.dtypes.astype(str)))).encode())
+        return h.hexdigest()
+
+    def get_key(self, df:pd.DataFrame, params:dict) -> str:
+        h = hashlib.md5()
+        h.update(self.hash_df(df).encode())
+        h.update(repr(sorted(params.items())).encode())
+        return h.hexdigest()
+
+    def _get_path(self, key:str) -> str:
+        return f"{self.cache_dir}/{key}.pkl"
+
+    def get(self, key:str):
+        """
+        Returns the cached dataframe, or None if there isn't one.
+        """
+        path = self._get_path(key)
+        if not os.path.exists(path):
+            self.n_misses += 1
+            return None
+        with open(path, "rb") as f:
+            feat_df = pickle.load(f)
+        # the modification time doubles as the last time this entry was used
+        os.utime(path)
+        self.n_hits += 1
+        return feat_df
+
+    def put(self, key:str, feat_df:pd.DataFrame):
+        path = self._get_path(key)
+        # write to a temporary file first, so that a concurrent reader never
+        # sees half an entry
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "wb") as f:
+            pickle.dump(feat_df, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, path)
+        self.evict()
+
+    def get_or_compute(self, df:pd.DataFrame, params:dict, compute_fn):
+        """
+        Returns the cached features for (df, params) if there are any,
+        otherwise computes compute_fn(df) and caches it.
+        """
+        key = self.get_key(df, params)
+        feat_df = self.get(key)
+        if feat_df is None:
+            feat_df = compute_fn(df)
+            self.put(key, feat_df)
+        return feat_df
+
+    def get_size_bytes(self) -> int:
+        return sum(size for _, size, _ in self._list_entries())
+
+    def _list_entries(self):
+        entries = []
+        for file_name in os.listdir(self.cache_dir):
+            if file_name.endswith(".pkl"):
+                stat = os.stat(f"{self.cache_dir}/{file_name}")
+                entries.append((file_name, stat.st_size, stat.st_mtime))
+        return entries
+
+    def evict(self):
+        """
+        Delete the least recently used entries until the cache fits in max_bytes.
+        """
+        entries = sorted(self._list_entries(), key=lambda entry: entry[2])
+        total_bytes = sum(size for _, size, _ in entries)
+        for file_name, size, _ in entries:
+            if total_bytes <= self.max_bytes:
+                break
+            os.remove(f"{self.cache_dir}/{file_name}")
+            total_bytes -= size
+
+    def clear(self):
+        for file_name, _, _ in self._list_entries():
+            os.remove(f"{self.cache_dir}/{file_name}")
@@ -0,0 +1,104 @@
+"""
+A shared mapping from fighter id --> integer index, used by all the elo and
+fighter power estimators to index into their power vectors and to build
+one-hot design matrices.
+
+Build one per pipeline run and hand it to every wrapper, so that all the
+estimators agree on which fighter is which. The mapping is stable: adding
+fighters appends them to the end, and never changes an existing fighter's
+index.
+
+Example:
+    fighter_index = FighterIndex.from_df(df)
+    fighter_index.save("data/fighter_index.pkl")
+    bin_ew = BinaryEloWrapper({"win_target": 0.5}, fighter_index=fighter_index)
+"""
+
+import pickle
+import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix
+
+
+class FighterIndex(object):
+
+    def __init__(self, fighter_ids=None):
+        """
+        fighter_ids: initial fighter ids, which get indexed in sorted order.
+            May contain duplicates.
+        """
+        self.fighter_ids = pd.Index([], dtype=object)
+        if fighter_ids is not None:
+            self.add(fighter_ids)
+
+    @classmethod
+    def from_df(cls, df:pd.DataFrame):
+        return cls(pd.concat([df["FighterID_espn"], df["OpponentID_espn"]]))
+
+    def __len__(self):
+        return len(self.fighter_ids)
+
+    def add(self, fighter_ids):
+        """
+        Append any fighters we haven't seen before, in sorted order.
+        """
+        new_fighter_ids = pd.Index(pd.unique(pd.Series(fighter_ids, dtype=object)))\
+            .difference(self.fighter_ids, sort=True)
+        if len(new_fighter_ids) > 0:
+            self.fighter_ids = self.fighter_ids.append(new_fighter_ids)
+
+    def get_codes(self, fighter_ids) -> np.ndarray:
+        """
+        int32 index of each fighter, or -1 for fighters we haven't seen.
+        """
+        return pd.Categorical(fighter_ids, categories=self.fighter_ids).codes\
+            .astype(np.int32)
+
+    def get_inds(self, fighter_ids) -> np.ndarray:
+        """
+        Same as get_codes, but raises a ValueError on fighters we haven't seen.
+        """
+        inds = self.get_codes(fighter_ids)
+        if (inds < 0).any():
+            unknown_ids = pd.Series(fighter_ids)[inds < 0].unique()
+            raise ValueError(f"Found unknown fighter ids: {unknown_ids[:10]}")
+        return inds
+
+    def get_powers(self, fighter_ids, powers:np.ndarray) -> np.ndarray:
+        """
+        Gather powers[index] for each fighter. powers may have been fit before
+        this index grew, so fighters past the end of powers, and fighters we
+        haven't seen at all, get a power of 0, same as before their first fight.
+        powers: (n_fighters,) or (n_fighters, n_columns) array.
+        """
+        codes = self.get_codes(fighter_ids)
+        is_known = (codes >= 0) & (codes < len(powers))
+        fighter_powers = np.zeros((len(codes),) + powers.shape[1:])
+        fighter_powers[is_known] = powers[codes[is_known]]
+        return fighter_powers
+
+    def one_hot(self, fighter_ids) -> csr_matrix:
+        """
+        (len(fighter_ids), len(self)) one-hot matrix. Rows for fighters we
+        haven't seen are all 0, like OneHotEncoder(handle_unknown="ignore").
+        """
+        codes = self.get_codes(fighter_ids)
+        rows = np.flatnonzero(codes >= 0)
+        return csr_matrix(
+            (np.ones(len(rows)), (rows, codes[rows])),
+            shape=(len(codes), len(self)),
+        )
+
+    def copy(self):
+        fighter_index = FighterIndex()
+        fighter_index.fighter_ids = self.fighter_ids.copy()
+        return fighter_index
+
+    def save(self, path:str):
+        with open(path, "wb") as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def load(path:str):
+        with open(path, "rb") as f:
+            return pickle.load(f)
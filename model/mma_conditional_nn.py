@@ -6,7 +6,154 @@ from tqdm import tqdm
 import numpy as np
 from model.mma_hier_log_reg_stan import logit
 
+
+class BatchedLinear(torch.nn.Module):
+    """
+    n_models independent torch.nn.Linear layers, applied all at once with a
+    batched matmul. Inputs and outputs have a leading n_models dimension.
+    """
+    
+    def __init__(self, n_models, in_features, out_features, bias=True):
+        super().__init__()
+        # same initialization as torch.nn.Linear
+        bound = 1 / np.sqrt(in_features)
+        self.weight = torch.nn.Parameter(
+            torch.empty(n_models, in_features, out_features).uniform_(-bound, bound))
+        if bias:
+            self.bias = torch.nn.Parameter(
+                torch.empty(n_models, 1, out_features).uniform_(-bound, bound))
+        else:
+            self.bias = None
         
+    def forward(self, x):
+        # x: (n_models, batch_size, in_features)
+        if self.bias is None:
+            return torch.bmm(x, self.weight)
+        return torch.baddbmm(self.bias, x, self.weight)
+
+
+def _train_model(model, X_f_train, X_o_train, y_train, ml_logit_train, lr, n_epochs, batch_size):
+    """
+    Train a single model with torch.optim.Adam on shuffled minibatches.
+    The training data is copied into tensors once, and each epoch only
+    shuffles the row indices into them.
+    """
+    optimizer = torch.optim.Adam(model.parameters(), lr=lr)
+    loss_fn = torch.nn.BCELoss() # binary cross entropy
+    X_f = torch.Tensor(X_f_train)
+    X_o = torch.Tensor(X_o_train)
+    ml = torch.Tensor(ml_logit_train).view(-1,1)
+    y = torch.Tensor(y_train).view(-1,1)
+    for epoch in tqdm(range(n_epochs)):
+        # shuffle dataset
+        shuffle_inds = torch.as_tensor(shuffle(np.arange(X_f.shape[0])))
+        # iterate over batches
+        for batch_inds in gen_batches(X_f.shape[0], batch_size):
+            rows = shuffle_inds[batch_inds]
+            optimizer.zero_grad()
+            y_hat = model(ml[rows], X_f[rows], X_o[rows])
+            loss = loss_fn(y_hat, y[rows])
+            loss.backward()
+            optimizer.step()
+    return model
+
+
+def _train_batched(model, train_sets, lrs, n_epochs, batch_size, 
+                   betas=(0.9, 0.999), eps=1e-8):
+    """
+    Train each of the n_models models in a batched model on its own
+    (X_f, X_o, y, ml_logit) in train_sets, with its own learning rate in lrs.
+    Same as n_models separate runs of Adam on shuffled minibatches, but each
+    step is one batched forward and backward pass over all of them.
+    The training rows are copied into tensors once, and each epoch only
+    shuffles indices into them. Adam is written out here rather than using
+    torch.optim.Adam, so that a model whose epoch has run out of batches
+    (it has fewer rows than the others) skips the step, like it would with
+    its own optimizer.
+    """
+    n_models = len(train_sets)
+    # every model's training rows, one model after the other
+    X_f = torch.as_tensor(np.concatenate([t[0] for t in train_sets]), dtype=torch.float32)
+    X_o = torch.as_tensor(np.concatenate([t[1] for t in train_sets]), dtype=torch.float32)
+    y = torch.as_tensor(np.concatenate([t[2] for t in train_sets]), dtype=torch.float32)
+    ml = torch.as_tensor(np.concatenate([t[3] for t in train_sets]), dtype=torch.float32)
+    n_rows = torch.tensor([len(t[2]) for t in train_sets])
+    starts = torch.cumsum(n_rows, 0) - n_rows
+    max_rows = int(n_rows.max())
+    positions = torch.arange(max_rows)
+    # (n_models, max_rows): is_valid[k, i] if model k has an i-th row, and
+    # model_rows[k, i] is where it is. Padded with row 0
+    is_valid = positions[None, :] < n_rows[:, None]
+    model_rows = torch.where(is_valid, starts[:, None] + positions[None, :], 
+                             torch.zeros((), dtype=torch.long))
+    lrs = torch.as_tensor(lrs, dtype=torch.float32)
+    
+    params = list(model.parameters())
+    exp_avgs = [torch.zeros_like(p) for p in params]
+    exp_avg_sqs = [torch.zeros_like(p) for p in params]
+    n_steps = torch.zeros(n_models)
+    for epoch in tqdm(range(n_epochs)):
+        # a random permutation of each model's own rows. Padding sorts last,
+        # so the valid rows stay in the first n_rows positions
+        keys = torch.rand(n_models, max_rows).masked_fill(~is_valid, 2.0)
+        shuffled_rows = model_rows.gather(1, keys.argsort(dim=1))
+        # iterate over batches
+        for start in range(0, max_rows, batch_size):
+            batch_rows = shuffled_rows[:, start:start+batch_size]
+            batch_mask = is_valid[:, start:start+batch_size].float()
+            batch_sizes = batch_mask.sum(1)
+            is_active = batch_sizes > 0
+            y_hat = model(ml[batch_rows].unsqueeze(-1), X_f[batch_rows], X_o[batch_rows])
+            bce = torch.nn.functional.binary_cross_entropy(
+                y_hat[..., 0], y[batch_rows], reduction="none")
+            # each model's mean loss over its own batch, like BCELoss. The
+            # models don't share parameters, so the sum's gradient wrt each
+            # model's parameters is just that of its own loss
+            losses = (bce * batch_mask).sum(1) / batch_sizes.clamp(min=1)
+            model.zero_grad()
+            losses.sum().backward()
+            n_steps += is_active
+            with torch.no_grad():
+                bias_correction1 = 1 - betas[0] ** n_steps.clamp(min=1)
+                bias_correction2 = 1 - betas[1] ** n_steps.clamp(min=1)
+                for p, exp_avg, exp_avg_sq in zip(params, exp_avgs, exp_avg_sqs):
+                    # per-model quantities, shaped to broadcast against p
+                    shape = (n_models,) + (1,) * (p.dim() - 1)
+                    active = is_active.view(shape)
+                    exp_avg.copy_(torch.where(
+                        active, betas[0] * exp_avg + (1 - betas[0]) * p.grad, exp_avg))
+                    exp_avg_sq.copy_(torch.where(
+                        active, betas[1] * exp_avg_sq + (1 - betas[1]) * p.grad**2, exp_avg_sq))
+                    denom = exp_avg_sq.sqrt() / bias_correction2.sqrt().view(shape) + eps
+                    step = (lrs / bias_correction1).view(shape) * exp_avg / denom
+                    p.sub_(torch.where(active, step, torch.zeros_like(step)))
+    return model
+
+
+def _predict_batched(model, test_sets):
+    """
+    Predictions of each of the models in a batched model for its own
+    (X_f, X_o, ml_logit) in test_sets, in one forward pass.
+    Returns a list of arrays, one per model.
+    """
+    n_rows = [len(t[2]) for t in test_sets]
+    max_rows = max(n_rows)
+    def stack(arrays):
+        # pad each model's rows to max_rows, the padding is ignored
+        padded = np.zeros((len(arrays), max_rows) + arrays[0].shape[1:])
+        for k, a in enumerate(arrays):
+            padded[k, :len(a)] = a
+        return torch.as_tensor(padded, dtype=torch.float32)
+    with torch.no_grad():
+        y_hat = model(
+            stack([t[2] for t in test_sets]).unsqueeze(-1),
+            stack([t[0] for t in test_sets]),
+            stack([t[1] for t in test_sets]),
+        )
+    y_hat = y_hat.numpy()[..., 0]
+    return [y_hat[k, :n] for k, n in enumerate(n_rows)]
+
+
 
 class SymmetricModel(torch.nn.Module):
     
@@ -35,6 +182,28 @@ class SymmetricModel(torch.nn.Module):
         y_hat = self.softmax(ml_logit + x_diffs)
         return y_hat
     
+
+class BatchedSymmetricModel(torch.nn.Module):
+    """
+    n_models independent SymmetricModels, trained and run as one. Inputs
+    and outputs have a leading n_models dimension.
+    """
+    
+    def __init__(self, n_models, input_dim, width_1, width_2):
+        super().__init__()
+        self.linear1 = BatchedLinear(n_models, input_dim, width_1)
+        self.activation = torch.nn.Tanh()
+        self.linear2 = BatchedLinear(n_models, width_1, width_2)
+        self.linear3 = BatchedLinear(n_models, width_2, 1, bias=False)
+        self.softmax = torch.nn.Sigmoid()
+        
+    def forward(self, ml_logit, x_f, x_o):
+        x_f = self.activation(self.linear2(self.activation(self.linear1(x_f))))
+        x_o = self.activation(self.linear2(self.activation(self.linear1(x_o))))
+        x_diffs = self.linear3(x_f - x_o)
+        return self.softmax(ml_logit + x_diffs)
+    
+
 class SymmetricModelWrapper(object):
     
     def __init__(self, fighter_cols, opponent_cols, n_pca=16, 
@@ -49,6 +218,7 @@ class SymmetricModelWrapper(object):
         self.n_epochs = n_epochs
         self.batch_size = batch_size
         self._model = None
+        self._batched_model = None
         
     def _get_X(self, train_df, test_df):
         X_temp = np.concatenate([train_df[self.fighter_cols], 
@@ -68,28 +238,22 @@ class SymmetricModelWrapper(object):
     def _train(self, X_f_train, X_o_train, y_train, ml_logit_train):
         input_dim = X_f_train.shape[1]
         self._model = SymmetricModel(input_dim, self.width_1, self.width_2)
-        optimizer = torch.optim.Adam(self._model.parameters(), lr=self.lr)
-        loss_fn = torch.nn.BCELoss() # binary cross entropy
-        for epoch in tqdm(range(self.n_epochs)):
-            # shuffle dataset
-            shuffle_inds = shuffle(range(X_f_train.shape[0]))
-            X_f = torch.Tensor(X_f_train[shuffle_inds,:])
-            X_o = torch.Tensor(X_o_train[shuffle_inds,:])
-            ml = torch.Tensor(ml_logit_train[shuffle_inds]).view(-1,1)
-            y = torch.Tensor(y_train[shuffle_inds]).view(-1,1)
-            # iterate over batches
-            for batch_inds in gen_batches(X_f.shape[0], self.batch_size):
-                optimizer.zero_grad()
-                y_hat = self._model(ml[batch_inds], X_f[batch_inds,:], X_o[batch_inds,:])
-                loss = loss_fn(y_hat, y[batch_inds])
-                loss.backward()
-                optimizer.step()
+        _train_model(self._model, X_f_train, X_o_train, y_train, ml_logit_train,
+                     self.lr, self.n_epochs, self.batch_size)
+        
+    def _train_batched(self, train_sets, lrs):
+        """
+        Train one model per (X_f, X_o, y, ml_logit) in train_sets, all at
+        once as a BatchedSymmetricModel.
+        """
+        input_dim = train_sets[0][0].shape[1]
+        model = BatchedSymmetricModel(len(train_sets), input_dim, self.width_1, self.width_2)
+        return _train_batched(model, train_sets, lrs, self.n_epochs, self.batch_size)
         
     def fit_predict(self, train_df, test_df):
         X_f_train, X_o_train, X_f_test, X_o_test = self._get_X(train_df, test_df)
         
         y_train = train_df["targetWin"].values
-        y_test = test_df["targetWin"].values
 
         ml_logit_train = logit(train_df["p_fighter_implied"]).values
         ml_logit_test = logit(test_df["p_fighter_implied"]).values
@@ -102,6 +266,33 @@ class SymmetricModelWrapper(object):
             torch.Tensor(X_o_test),
         )
         return y_hat.detach().numpy()[:,0]
+    
+    def fit_predict_batched(self, train_dfs, test_dfs, lrs=None):
+        """
+        Same as fit_predict on each (train_df, test_df) pair, eg each fold of
+        a CV, but all the models train simultaneously as one batched model,
+        kept in self._batched_model. See check_conditional_nn.py for how it
+        compares with fit_predict.
+        lrs: learning rate for each pair, eg to try several configs on the
+            same data. Defaults to self.lr for all of them.
+        Returns a list of the predictions for each test_df.
+        """
+        if lrs is None:
+            lrs = [self.lr] * len(train_dfs)
+        train_sets, test_sets = [], []
+        for train_df, test_df in zip(train_dfs, test_dfs):
+            X_f_train, X_o_train, X_f_test, X_o_test = self._get_X(train_df, test_df)
+            
+            y_train = train_df["targetWin"].values
+            
+            ml_logit_train = logit(train_df["p_fighter_implied"]).values
+            ml_logit_test = logit(test_df["p_fighter_implied"]).values
+            
+            train_sets.append((X_f_train, X_o_train, y_train, ml_logit_train))
+            test_sets.append((X_f_test, X_o_test, ml_logit_test))
+        
+        self._batched_model = self._train_batched(train_sets, lrs)
+        return _predict_batched(self._batched_model, test_sets)
             
 
 class NonSymmetricModel(torch.nn.Module):
@@ -135,6 +326,30 @@ class NonSymmetricModel(torch.nn.Module):
         return y_hat
     
 
+class BatchedNonSymmetricModel(torch.nn.Module):
+    """
+    n_models independent NonSymmetricModels, trained and run as one. Inputs
+    and outputs have a leading n_models dimension.
+    """
+    
+    def __init__(self, n_models, input_dim, width_1, width_2, width_3):
+        super().__init__()
+        self.linear1 = BatchedLinear(n_models, input_dim, width_1)
+        self.activation = torch.nn.Tanh()
+        self.linear2 = BatchedLinear(n_models, width_1, width_2)
+        self.linear3 = BatchedLinear(n_models, width_2*2, width_3)
+        self.linear4 = BatchedLinear(n_models, width_3, 1)
+        self.softmax = torch.nn.Sigmoid()
+        
+    def forward(self, ml_logit, x_f, x_o):
+        x_f = self.activation(self.linear2(self.activation(self.linear1(x_f))))
+        x_o = self.activation(self.linear2(self.activation(self.linear1(x_o))))
+        # concat along the feature dimension
+        x = torch.concat((x_f, x_o), 2)
+        x = self.linear4(self.activation(self.linear3(x)))
+        return self.softmax(ml_logit + x)
+    
+
 class NonSymmetricModelWrapper(object):
     
     def __init__(self, fighter_cols, opponent_cols, n_pca=16, 
@@ -150,6 +365,7 @@ class NonSymmetricModelWrapper(object):
         self.n_epochs = n_epochs
         self.batch_size = batch_size
         self._model = None
+        self._batched_model = None
         
     def _get_X(self, train_df, test_df):
         X_temp = np.concatenate([train_df[self.fighter_cols], 
@@ -179,28 +395,24 @@ class NonSymmetricModelWrapper(object):
         )
         input_dim = X_f_train.shape[1]
         self._model = NonSymmetricModel(input_dim, self.width_1, self.width_2, self.width_3)
-        optimizer = torch.optim.Adam(self._model.parameters(), lr=self.lr)
-        loss_fn = torch.nn.BCELoss() # binary cross entropy
-        for epoch in tqdm(range(self.n_epochs)):
-            # shuffle dataset
-            shuffle_inds = shuffle(range(X_f_train.shape[0]))
-            X_f = torch.Tensor(X_f_train[shuffle_inds,:])
-            X_o = torch.Tensor(X_o_train[shuffle_inds,:])
-            ml = torch.Tensor(ml_logit_train[shuffle_inds]).view(-1,1)
-            y = torch.Tensor(y_train[shuffle_inds]).view(-1,1)
-            # iterate over batches
-            for batch_inds in gen_batches(X_f.shape[0], self.batch_size):
-                optimizer.zero_grad()
-                y_hat = self._model(ml[batch_inds], X_f[batch_inds,:], X_o[batch_inds,:])
-                loss = loss_fn(y_hat, y[batch_inds])
-                loss.backward()
-                optimizer.step()
+        _train_model(self._model, X_f_train, X_o_train, y_train, ml_logit_train,
+                     self.lr, self.n_epochs, self.batch_size)
+        
+    def _train_batched(self, train_sets, lrs):
+        """
+        Train one model per (X_f, X_o, y, ml_logit) in train_sets, each on
+        its doubled data, all at once as a BatchedNonSymmetricModel.
+        """
+        train_sets = [self._get_doubled_data(*train_set) for train_set in train_sets]
+        input_dim = train_sets[0][0].shape[1]
+        model = BatchedNonSymmetricModel(len(train_sets), input_dim, 
+                                         self.width_1, self.width_2, self.width_3)
+        return _train_batched(model, train_sets, lrs, self.n_epochs, self.batch_size)
         
     def fit_predict(self, train_df, test_df):
         X_f_train, X_o_train, X_f_test, X_o_test = self._get_X(train_df, test_df)
         
         y_train = train_df["targetWin"].values
-        y_test = test_df["targetWin"].values
 
         ml_logit_train = logit(train_df["p_fighter_implied"]).values
         ml_logit_test = logit(test_df["p_fighter_implied"]).values
@@ -221,4 +433,35 @@ class NonSymmetricModelWrapper(object):
             y_hat1.detach().numpy()[:,0] +
             (1 - y_hat2.detach().numpy()[:,0])
         ) / 2
-        return y_hat
\ No newline at end of file
+        return y_hat
+    
+    def fit_predict_batched(self, train_dfs, test_dfs, lrs=None):
+        """
+        Same as fit_predict on each (train_df, test_df) pair, eg each fold of
+        a CV, but all the models train simultaneously as one batched model,
+        kept in self._batched_model. See check_conditional_nn.py for how it
+        compares with fit_predict.
+        lrs: learning rate for each pair, eg to try several configs on the
+            same data. Defaults to self.lr for all of them.
+        Returns a list of the predictions for each test_df.
+        """
+        if lrs is None:
+            lrs = [self.lr] * len(train_dfs)
+        train_sets, test_sets = [], []
+        for train_df, test_df in zip(train_dfs, test_dfs):
+            X_f_train, X_o_train, X_f_test, X_o_test = self._get_X(train_df, test_df)
+            
+            y_train = train_df["targetWin"].values
+            
+            ml_logit_train = logit(train_df["p_fighter_implied"]).values
+            ml_logit_test = logit(test_df["p_fighter_implied"]).values
+            
+            train_sets.append((X_f_train, X_o_train, y_train, ml_logit_train))
+            test_sets.append((X_f_test, X_o_test, ml_logit_test))
+        
+        self._batched_model = self._train_batched(train_sets, lrs)
+        y_hat1 = _predict_batched(self._batched_model, test_sets)
+        # and with the fighter and opponent swapped
+        y_hat2 = _predict_batched(self._batched_model, [(X_o, X_f, -1 * ml_logit) 
+                                                for X_f, X_o, ml_logit in test_sets])
+        return [(y1 + (1 - y2)) / 2 for y1, y2 in zip(y_hat1, y_hat2)]
@@ -4,12 +4,98 @@ import matplotlib.pyplot as plt
 import seaborn as sns
 from tqdm import tqdm 
 from sklearn.metrics import log_loss, accuracy_score, mean_squared_error, mean_absolute_error
-from sklearn.preprocessing import OneHotEncoder
 from scipy.special import expit, logit
 from abc import ABC, abstractmethod
+import math
+import copy
+import pickle
+from model.fighter_index import FighterIndex
 
 unknown_fighter_id = "2557037" # "2557037/unknown-fighter"
 
+def _scalar_expit(x):
+    # math.exp on python floats is much cheaper than scipy's expit on numpy
+    # scalars. Branch on the sign so exp never overflows.
+    if x >= 0:
+        return 1 / (1 + math.exp(-x))
+    z = math.exp(x)
+    return z / (1 + z)
+
+def _expit_matchup_matrix(row_scores, col_scores, out_path=None, block_size=1024):
+    """
+    (len(row_scores), len(col_scores)) matrix whose [i, j] entry is
+    expit(row_scores[i] - col_scores[j]).
+    If out_path is given, the matrix is written to a float32 .npy memmap
+    there, block_size rows at a time, and the memmap is returned. Use this
+    for the full roster, which doesn't fit in memory as float64.
+    """
+    row_scores = np.asarray(row_scores, dtype=float)
+    col_scores = np.asarray(col_scores, dtype=float)
+    if out_path is None:
+        return expit(row_scores[:, None] - col_scores[None, :])
+    out = np.lib.format.open_memmap(
+        out_path, mode="w+", dtype=np.float32,
+        shape=(len(row_scores), len(col_scores)),
+    )
+    for start in range(0, len(row_scores), block_size):
+        end = start + block_size
+        out[start:end] = expit(row_scores[start:end, None] - col_scores[None, :])
+    out.flush()
+    return out
+
+def _acc_elo_kernel(fighter_inds, opponent_inds, y_fighter, n_fighter,
+                    y_opponent, n_opponent, offense_powers, defense_powers,
+                    power_intercept, alpha):
+    """
+    Sequential accuracy-elo updates, one fight at a time. Each fight only
+    touches the powers of its two fighters, so this is O(1) per fight.
+    All array arguments are 1-D numpy arrays; offense_powers and 
+    defense_powers are updated in place.
+    Returns (fighter_offense_elos, fighter_defense_elos, opponent_offense_elos,
+    opponent_defense_elos, fighter_offense_deltas, opponent_offense_deltas),
+    where the elos are the powers *before* each fight.
+    """
+    n = len(fighter_inds)
+    fighter_offense_elos = np.zeros(n)
+    fighter_defense_elos = np.zeros(n)
+    opponent_offense_elos = np.zeros(n)
+    opponent_defense_elos = np.zeros(n)
+    fighter_offense_deltas = np.zeros(n)
+    opponent_offense_deltas = np.zeros(n)
+    # indexing into python lists is a lot faster than into numpy arrays
+    offense = offense_powers.tolist()
+    defense = defense_powers.tolist()
+    power_intercept = float(power_intercept)
+    alpha = float(alpha)
+    rows = zip(fighter_inds.tolist(), opponent_inds.tolist(),
+               y_fighter.tolist(), n_fighter.tolist(),
+               y_opponent.tolist(), n_opponent.tolist())
+    for i, (f, o, y_f, n_f, y_o, n_o) in enumerate(rows):
+        f_off, f_def = offense[f], defense[f]
+        o_off, o_def = offense[o], defense[o]
+        p_fighter_hat = _scalar_expit(f_off - o_def + power_intercept)
+        p_opponent_hat = _scalar_expit(o_off - f_def + power_intercept)
+        # delta is oriented in the direction of the fighter i guess
+        # update the fighter's offense and opponent's defense
+        delta_p_fighter_landed = alpha * (y_f - (n_f * p_fighter_hat))
+        offense[f] += 0.5 * delta_p_fighter_landed
+        defense[o] -= 0.5 * delta_p_fighter_landed
+        delta_p_opponent_landed = alpha * (y_o - (n_o * p_opponent_hat))
+        offense[o] += 0.5 * delta_p_opponent_landed
+        defense[f] -= 0.5 * delta_p_opponent_landed
+
+        fighter_offense_elos[i] = f_off
+        fighter_defense_elos[i] = f_def
+        opponent_offense_elos[i] = o_off
+        opponent_defense_elos[i] = o_def
+        fighter_offense_deltas[i] = delta_p_fighter_landed
+        opponent_offense_deltas[i] = delta_p_opponent_landed
+    offense_powers[:] = offense
+    defense_powers[:] = defense
+    return (fighter_offense_elos, fighter_defense_elos,
+            opponent_offense_elos, opponent_defense_elos,
+            fighter_offense_deltas, opponent_offense_deltas)
+
 class BaseEloEstimator(ABC):
     """
     Abstract Base class for Elo estimators.
@@ -22,10 +108,10 @@ class BaseEloEstimator(ABC):
     def __init__(self, target_col, alpha=0.5):
         self.target_col = target_col
         self.alpha = alpha
-        self.fighter_ids = None
+        # FighterIndex, possibly shared with other estimators
+        self.fighter_index = None
         self.fighter_ids_with_target = None
         self.useless_fighter_ids = None
-        self._fighter_encoder = None
         self._fighter_powers = None
         self.elo_feature_df = None
         # store the matrices for the fighter ids and opponent ids
@@ -35,12 +121,16 @@ class BaseEloEstimator(ABC):
         # self.workhorse_df = None
 
     def transform_fighter_ids(self, fighter_ids:pd.Series):
-        return self._fighter_encoder.transform(fighter_ids.values.reshape(-1,1))
+        return self.fighter_index.one_hot(fighter_ids)
     
     def fit_fighter_encoder(self, fighter_ids:pd.Series):
-        self.fighter_ids = sorted(set(fighter_ids))
-        self._fighter_encoder = OneHotEncoder(handle_unknown="error")
-        self._fighter_encoder.fit(fighter_ids.values.reshape(-1,1))
+        self.fighter_index = FighterIndex(fighter_ids)
+
+    def get_fighter_inds(self, fighter_ids:pd.Series) -> np.ndarray:
+        """
+        Get the integer index of each fighter into self._fighter_powers.
+        """
+        return self.fighter_index.get_inds(fighter_ids)
 
     def fit_initial_params(self, df:pd.DataFrame):
         """
@@ -53,8 +143,9 @@ class BaseEloEstimator(ABC):
         Get update to the powers of the fighters, given the observed target.
         Note that this is a "batch" update, i.e. it updates all the powers
         at once.
-        Also, this is a "doubled" dataset, i.e. that each fight is
-        represented twice, once for each (Fighter, Opponent) permutation.
+        This should be the full update for both fighters, from the point of
+        view of one row of each fight. fit() takes "doubled" data, and
+        averages the updates from each fight's two rows.
         - y_true: the observed target. May be NaN!
         - fighter_elo: the powers of the fighters. Never NaN.
         - opponent_elo: the powers of the opponents. Never NaN.
@@ -65,7 +156,7 @@ class BaseEloEstimator(ABC):
         These will be added to the corresponding indices in self._fighter_powers.
         """
         raise NotImplementedError()
-    
+
     def predict_given_powers(self, fighter_elo:np.ndarray, opponent_elo:np.ndarray, X: np.ndarray) -> np.ndarray:
         """
         Predict the target given the powers of the fighters. df may be used to
@@ -80,95 +171,211 @@ class BaseEloEstimator(ABC):
         """
         return np.zeros((len(df), 0))
 
+    def _update_group(self, fighter_powers:np.ndarray, curr_fighter:np.ndarray,
+                      curr_opponent:np.ndarray, y:np.ndarray, X:np.ndarray,
+                      mirror_y:np.ndarray, mirror_X:np.ndarray):
+        """
+        Predict and update the powers for one date's worth of fights, one
+        row per fight. mirror_y and mirror_X are the target and features of
+        each fight's other row, where the fighter and opponent are swapped.
+        fighter_powers is updated in place.
+        Returns (y_hat, mirror_y_hat, fighter_elo, opponent_elo,
+        updated_fighter_elo, updated_opponent_elo), one entry per fight.
+        """
+        # get the powers of the fighters and opponents (len(grp),)
+        curr_fighter_powers = fighter_powers[curr_fighter]
+        curr_opponent_powers = fighter_powers[curr_opponent]
+        # predict the target given the current powers, from both points of view
+        y_hat = self.predict_given_powers(
+            curr_fighter_powers, curr_opponent_powers, X
+        )
+        mirror_y_hat = self.predict_given_powers(
+            curr_opponent_powers, curr_fighter_powers, mirror_X
+        )
+        # each row gives a full update for the fight, so average the two.
+        # Usually the rows mirror each other and the two updates are equal,
+        # but not always, eg if the target is missing on just one row
+        fighter_delta, opponent_delta = self.get_elo_update(
+            y, curr_fighter_powers, curr_opponent_powers, X
+        )
+        mirror_opponent_delta, mirror_fighter_delta = self.get_elo_update(
+            mirror_y, curr_opponent_powers, curr_fighter_powers, mirror_X
+        )
+        # A fighter may appear in several rows of the group, so scatter-add
+        # rather than assign
+        np.add.at(fighter_powers, curr_fighter, 0.5 * (fighter_delta + mirror_fighter_delta))
+        np.add.at(fighter_powers, curr_opponent, 0.5 * (opponent_delta + mirror_opponent_delta))
+        return (y_hat, mirror_y_hat, curr_fighter_powers, curr_opponent_powers,
+                fighter_powers[curr_fighter], fighter_powers[curr_opponent])
+
+    def get_state(self):
+        """
+        Snapshot of the fitted powers, which can be saved, loaded, and
+        updated one event at a time. See EloState.
+        """
+        return EloState(self)
+
     def fit(self, df:pd.DataFrame):
         """
         Assuming that the data is "doubled" - i.e. that each fight is
         represented twice, once for each (Fighter, Opponent) permutation.
         Returns a dataframe with the same number of rows as the input df.
+        Internally, the powers are only gathered and updated once per fight,
+        see _fit_doubled_arrays.
         df: pd.DataFrame
         """
         assert (df["fight_id"].value_counts() == 2).all()
         df = df.sort_values(["fight_id", "FighterID_espn", "OpponentID_espn"])\
             .reset_index(drop=True)
-        if self.fighter_ids is None:
+        if self.fighter_index is None:
             self.fit_fighter_encoder(df["FighterID_espn"])
-        self._fighter_powers = np.zeros(len(self.fighter_ids))
+        else:
+            # a shared index may not have seen all of these fighters yet
+            self.fighter_index.add(df["FighterID_espn"])
+        self._fighter_powers = np.zeros(len(self.fighter_index))
         # fit initial params, if any
         self.fit_initial_params(df)
-        fighter_id_mat = self.transform_fighter_ids(df["FighterID_espn"])
-        opponent_id_mat = self.transform_fighter_ids(df["OpponentID_espn"])
+        elo_arrays = self._fit_doubled_arrays(
+            self._fighter_powers,
+            self.get_fighter_inds(df["FighterID_espn"]),
+            self.get_fighter_inds(df["OpponentID_espn"]),
+            df["Date"].values,
+            df[self.target_col].values,
+            self.extract_features(df),
+        )
         fitted_elo_df = df[[
             "fight_id", "FighterID_espn", "OpponentID_espn", "Date",
             self.target_col,
-        ]].assign(
-            pred_elo_target=np.nan, fighter_elo=np.nan, opponent_elo=np.nan,
-            updated_fighter_elo=np.nan, updated_opponent_elo=np.nan,
+        ]].assign(**elo_arrays)
+        self.elo_feature_df = fitted_elo_df.drop(columns=["Date"])
+        return fitted_elo_df
+
+    def _fit_doubled_arrays(self, fighter_powers:np.ndarray, fighter_inds:np.ndarray,
+                            opponent_inds:np.ndarray, dates:np.ndarray, y:np.ndarray,
+                            X:np.ndarray) -> dict:
+        """
+        Run the elo updates over "doubled" rows, sorted so that the two rows
+        of each fight are adjacent. The powers are only gathered and updated
+        once per fight, from the first row's point of view, but the second
+        row still gets its own prediction and update from its own target and
+        features. See _update_group.
+        fighter_powers is updated in place.
+        Returns a dict like _fit_arrays, with one entry per doubled row.
+        """
+        elo_arrays = self._fit_arrays(
+            fighter_powers, fighter_inds[::2], opponent_inds[::2], dates[::2],
+            y[::2], X[::2], y[1::2], X[1::2],
         )
-        X = self.extract_features(df)
+        return self._double_elo_arrays(elo_arrays)
+
+    def _fit_arrays(self, fighter_powers:np.ndarray, fighter_inds:np.ndarray,
+                    opponent_inds:np.ndarray, dates:np.ndarray, y:np.ndarray,
+                    X:np.ndarray, mirror_y:np.ndarray, mirror_X:np.ndarray) -> dict:
+        """
+        Run the elo updates over a set of fights, one row per fight, one
+        date at a time. mirror_y and mirror_X are the target and features of
+        each fight from the opponent's point of view.
+        fighter_powers is updated in place.
+        Returns a dict mapping pred_elo_target, mirror_pred_elo_target,
+        fighter_elo, opponent_elo, updated_fighter_elo and
+        updated_opponent_elo --> arrays with one entry per fight (or one row,
+        if the powers are a matrix).
+        """
+        # sort everything by date once (stably, so that each date's rows keep
+        # their order). Then each date's rows are a contiguous slice,
+        # and slicing doesn't copy anything
+        date_order = np.argsort(dates, kind="stable")
+        sorted_dates = dates[date_order]
+        fighter_inds = fighter_inds[date_order]
+        opponent_inds = opponent_inds[date_order]
+        X = X[date_order]
+        y = y[date_order]
+        mirror_X = mirror_X[date_order]
+        mirror_y = mirror_y[date_order]
+        grp_bounds = np.flatnonzero(sorted_dates[1:] != sorted_dates[:-1]) + 1
+        grp_starts = np.concatenate([[0], grp_bounds])
+        grp_ends = np.concatenate([grp_bounds, [len(dates)]])
+        elo_shape = (len(dates),) + fighter_powers.shape[1:]
+        sorted_elo_arrays = [np.empty(elo_shape) for _ in range(6)]
         # loop over dates
-        for dt, grp in tqdm(df.groupby("Date")):
-            # df's index is simply the row number, so we can use that to
-            # index into the matrices. But this is the only place where
-            # we are allowed to do that! Inside the methods defined by the
-            # inheriting classes, we should only use numpy objects.
-
-            # pseudocode sketch
-            # 0. get powers for the fighters in this group
-            curr_fighter = fighter_id_mat[grp.index]
-            # # get current opponents (len(grp), n_fighters)
-            curr_opponent = opponent_id_mat[grp.index]
-            # get the powers of the fighters (len(grp),)
-            curr_fighter_powers = self._fighter_powers @ curr_fighter.T
-            # get the powers of the opponents
-            curr_opponent_powers = self._fighter_powers @ curr_opponent.T
-            # any current features that we want to use
-            curr_X = X[grp.index]
-            # 1. predict the target given the current powers
-            y_hat = self.predict_given_powers(
-                curr_fighter_powers, curr_opponent_powers, curr_X
-            )
-            # 2. save the predictions
-            fitted_elo_df.loc[grp.index, "pred_elo_target"] = y_hat
-            # 3. save the current powers
-            fitted_elo_df.loc[grp.index, "fighter_elo"] = curr_fighter_powers
-            fitted_elo_df.loc[grp.index, "opponent_elo"] = curr_opponent_powers
-            # 4. update the powers
-            fighter_delta, opponent_delta = self.get_elo_update(
-                grp[self.target_col].values, curr_fighter_powers, curr_opponent_powers, curr_X
+        for start, end in tqdm(zip(grp_starts, grp_ends), total=len(grp_starts)):
+            grp_elo_arrays = self._update_group(
+                fighter_powers, fighter_inds[start:end], opponent_inds[start:end],
+                y[start:end], X[start:end], mirror_y[start:end], mirror_X[start:end],
             )
-            self._fighter_powers += fighter_delta @ curr_fighter
-            self._fighter_powers += opponent_delta @ curr_opponent
-            # 5. save the updated powers
-            fitted_elo_df.loc[grp.index, "updated_fighter_elo"] = self._fighter_powers @ curr_fighter.T
-            fitted_elo_df.loc[grp.index, "updated_opponent_elo"] = self._fighter_powers @ curr_opponent.T
-        self.elo_feature_df = fitted_elo_df.drop(columns=["Date"])
-        return fitted_elo_df
+            for sorted_elo_array, grp_elo_array in zip(sorted_elo_arrays, grp_elo_arrays):
+                sorted_elo_array[start:end] = grp_elo_array
+        # put the rows back in their original order
+        elo_arrays = dict()
+        for col, sorted_elo_array in zip([
+            "pred_elo_target", "mirror_pred_elo_target", "fighter_elo", "opponent_elo",
+            "updated_fighter_elo", "updated_opponent_elo",
+        ], sorted_elo_arrays):
+            elo_arrays[col] = np.empty(elo_shape)
+            elo_arrays[col][date_order] = sorted_elo_array
+        return elo_arrays
+
+    def _double_elo_arrays(self, elo_arrays:dict) -> dict:
+        """
+        Given the output of _fit_arrays for one row per fight, get the
+        outputs for the "doubled" rows: each fight's row is followed by its
+        mirror image, where the fighter and opponent are swapped.
+        """
+        mirror_cols = {
+            "pred_elo_target": "mirror_pred_elo_target",
+            "fighter_elo": "opponent_elo",
+            "opponent_elo": "fighter_elo",
+            "updated_fighter_elo": "updated_opponent_elo",
+            "updated_opponent_elo": "updated_fighter_elo",
+        }
+        doubled_elo_arrays = dict()
+        for col, mirror_col in mirror_cols.items():
+            elo_array = elo_arrays[col]
+            mirror_elo_array = elo_arrays[mirror_col]
+            doubled_elo_array = np.empty((2 * len(elo_array),) + elo_array.shape[1:])
+            doubled_elo_array[0::2] = elo_array
+            doubled_elo_array[1::2] = mirror_elo_array
+            doubled_elo_arrays[col] = doubled_elo_array
+        return doubled_elo_arrays
     
+    def get_fighter_powers(self, fighter_ids:pd.Series) -> np.ndarray:
+        """
+        Look up the current power of each fighter. Fighters that the powers
+        weren't fit on (eg debuts, or fighters added to a shared
+        FighterIndex later) have a power of 0, same as at the start of fit().
+        """
+        return self.fighter_index.get_powers(fighter_ids, self._fighter_powers)
+
+    def predict_pairs(self, fighter_ids:pd.Series, opponent_ids:pd.Series, X:np.ndarray=None):
+        """
+        Predict the target for each (fighter, opponent) pair, given the
+        current powers. Just two gathers per pair, so this is cheap even for
+        big batches, eg every possible pairing on a card.
+        X: the additional features from extract_features, if the estimator
+            uses any.
+        Returns (y_hat, fighter_elo, opponent_elo) arrays.
+        """
+        fighter_elo = self.get_fighter_powers(fighter_ids)
+        opponent_elo = self.get_fighter_powers(opponent_ids)
+        if X is None:
+            X = np.zeros((len(fighter_elo), 0))
+        y_hat = self.predict_given_powers(fighter_elo, opponent_elo, X)
+        return y_hat, fighter_elo, opponent_elo
+
     def predict(self, test_df: pd.DataFrame):
-        # use predict_given_powers to predict on the test data
-        # needn't sort the test data by date or anything, since we're not
-        # updating the powers
-        test_df = test_df.copy() 
-        # transform the fighter ids into a (n_fights, n_fighters) matrix
-        fighter_id_mat = self.transform_fighter_ids(test_df["FighterID_espn"])
-        # transform the opponent ids into a (n_fights, n_fighters) matrix
-        opponent_id_mat = self.transform_fighter_ids(test_df["OpponentID_espn"])
-        # get the powers of the fighters (len(grp),)
-        curr_fighter_powers = self._fighter_powers @ fighter_id_mat.T
-        # get the powers of the opponents
-        curr_opponent_powers = self._fighter_powers @ opponent_id_mat.T
-        # any current features that we want to use
-        X = self.extract_features(test_df)
-        # 1. predict the target given the current powers
-        y_hat = self.predict_given_powers(
-            curr_fighter_powers, curr_opponent_powers, X
+        """
+        Predict on test_df given the current powers. test_df needn't be
+        sorted by date, or doubled, since we're not updating the powers.
+        Returns the key columns of test_df, plus pred_elo_target, fighter_elo
+        and opponent_elo.
+        """
+        y_hat, fighter_elo, opponent_elo = self.predict_pairs(
+            test_df["FighterID_espn"], test_df["OpponentID_espn"],
+            self.extract_features(test_df),
+        )
+        return test_df[["fight_id", "FighterID_espn", "OpponentID_espn"]].assign(
+            pred_elo_target=y_hat, fighter_elo=fighter_elo, opponent_elo=opponent_elo,
         )
-        # 2. save the predictions
-        test_df["pred_elo_target"] = y_hat
-        # save fighter and opponent powers too, while we're at it
-        test_df["fighter_elo"] = curr_fighter_powers
-        test_df["opponent_elo"] = curr_opponent_powers
-        return test_df
     
     def fit_predict(self, train_df: pd.DataFrame, test_df: pd.DataFrame):
         """
@@ -191,14 +398,13 @@ class RealEloEstimator(BaseEloEstimator):
     def predict_given_powers(self, fighter_elo:np.ndarray, opponent_elo:np.ndarray, X: np.ndarray) -> np.ndarray:
         # Simply return the difference in elo scores
         return fighter_elo - opponent_elo
-    
+
     def get_elo_update(self, y_true:np.ndarray, fighter_elo:np.ndarray, opponent_elo:np.ndarray, X: np.ndarray):
         # get predictions
         y_hat = self.predict_given_powers(fighter_elo, opponent_elo, X)
         # the usual update rule is:
         # self._fighter_powers += 0.5 * (alpha * (y_true - y_hat))
-        # because df is "doubled", we need to divide by 2
-        delta = 0.25 * self.alpha * (y_true - y_hat)
+        delta = 0.5 * self.alpha * (y_true - y_hat)
         delta[np.isnan(delta)] = 0
         return (delta, -1 * delta)
  
@@ -211,14 +417,24 @@ class BinaryEloEstimator(BaseEloEstimator):
 
     def predict_given_powers(self, fighter_elo: np.ndarray, opponent_elo: np.ndarray, X: np.ndarray) -> np.ndarray:
         return expit(fighter_elo - opponent_elo)
+
+    def predict_matchup_matrix(self, fighter_ids, out_path=None):
+        """
+        (n, n) matrix whose [i, j] entry is the probability that
+        fighter_ids[i] beats fighter_ids[j], given the current powers.
+        Fighters the powers weren't fit on have a power of 0.
+        out_path: if given, write the matrix to a float32 .npy memmap there.
+        """
+        assert self._fighter_powers.ndim == 1, "only for single-target estimators"
+        fighter_powers = self.get_fighter_powers(pd.Series(fighter_ids))
+        return _expit_matchup_matrix(fighter_powers, fighter_powers, out_path=out_path)
     
     def get_elo_update(self, y_true: np.ndarray, fighter_elo: np.ndarray, opponent_elo: np.ndarray, X: np.ndarray):
         # get predictions
         y_hat = self.predict_given_powers(fighter_elo, opponent_elo, X)
         # the usual update rule is the same as for real-valued outcomes:
         # self._fighter_powers += 0.5 * (alpha * (y_true - y_hat))
-        # because df is "doubled", we need to divide by 2
-        delta = 0.25 * self.alpha * (y_true - y_hat)
+        delta = 0.5 * self.alpha * (y_true - y_hat)
         delta[np.isnan(delta)] = 0
         return (delta, -1 * delta)
     
@@ -254,23 +470,224 @@ class BinaryEloErrorEstimator(BinaryEloEstimator):
         return expit(X + fighter_elo - opponent_elo)
     
 
+class MultiEloMixin(object):
+    """
+    Mix in before a BaseEloEstimator subclass to fit several (target, alpha)
+    columns at once. Fighter powers are a (n_fighters, n_columns) matrix, so
+    all the columns are updated in a single pass over the date groups. Each
+    column is updated exactly like the single-target estimator would update
+    it, and NaN targets only leave their own column unchanged.
+    This relies on predict_given_powers and get_elo_update being elementwise,
+    so that they broadcast over the columns.
+    """
+
+    def __init__(self, target_cols, alphas=0.5, col_suffixes=None):
+        """
+        Parameters
+        ----------
+        target_cols : list of str
+            The target column for each power column. May repeat, eg to fit
+            the same target with several alphas.
+        alphas : float or list of float, optional
+            The learning rate for each power column, by default 0.5
+        col_suffixes : list of str, optional
+            Suffix for each power column's features, eg pred_elo_{suffix}.
+            By default the target columns, which must then be unique.
+        """
+        self.target_cols = list(target_cols)
+        if col_suffixes is None:
+            col_suffixes = self.target_cols
+        assert len(set(col_suffixes)) == len(self.target_cols)
+        self.col_suffixes = list(col_suffixes)
+        alphas = np.broadcast_to(np.asarray(alphas, dtype=float), (len(self.target_cols),))
+        super().__init__(target_col=None, alpha=alphas)
+
+    def _get_elo_feature_cols(self, elo_arrays:dict, y:np.ndarray=None) -> dict:
+        # name the per-column features the way BaseEloWrapper renames them,
+        # grouped by column, each group preceded by its target if y is given
+        elo_feature_cols = dict()
+        for j, (target_col, suffix) in enumerate(zip(self.target_cols, self.col_suffixes)):
+            if y is not None:
+                elo_feature_cols[target_col] = y[:, j]
+            for col, elo_array in elo_arrays.items():
+                col_name = f"pred_elo_{suffix}" if col == "pred_elo_target" \
+                    else f"{col}_{suffix}"
+                elo_feature_cols[col_name] = elo_array[:, j]
+        return elo_feature_cols
+
+    def fit(self, df:pd.DataFrame):
+        """
+        Assuming that the data is "doubled" - i.e. that each fight is
+        represented twice, once for each (Fighter, Opponent) permutation.
+        Returns a dataframe with the same number of rows as the input df,
+        with pred_elo_{suffix}, fighter_elo_{suffix}, etc columns
+        for each power column.
+        df: pd.DataFrame
+        """
+        assert (df["fight_id"].value_counts() == 2).all()
+        df = df.sort_values(["fight_id", "FighterID_espn", "OpponentID_espn"])\
+            .reset_index(drop=True)
+        if self.fighter_index is None:
+            self.fit_fighter_encoder(df["FighterID_espn"])
+        else:
+            self.fighter_index.add(df["FighterID_espn"])
+        n_cols = len(self.target_cols)
+        self._fighter_powers = np.zeros((len(self.fighter_index), n_cols))
+        # each array is (len(df), n_cols). self.alpha broadcasts across
+        # the power columns
+        elo_arrays = self._fit_doubled_arrays(
+            self._fighter_powers,
+            self.get_fighter_inds(df["FighterID_espn"]),
+            self.get_fighter_inds(df["OpponentID_espn"]),
+            df["Date"].values,
+            df[self.target_cols].values.astype(float),
+            self.extract_features(df),
+        )
+        fitted_elo_df = df[["fight_id", "FighterID_espn", "OpponentID_espn", "Date"]]\
+            .assign(**self._get_elo_feature_cols(elo_arrays, y=df[self.target_cols].values))
+        self.elo_feature_df = fitted_elo_df.drop(columns=["Date"])
+        return fitted_elo_df
+
+    def predict(self, test_df: pd.DataFrame):
+        # each array is (len(test_df), n_cols)
+        y_hat, curr_fighter_powers, curr_opponent_powers = self.predict_pairs(
+            test_df["FighterID_espn"], test_df["OpponentID_espn"],
+            self.extract_features(test_df),
+        )
+        elo_feature_cols = self._get_elo_feature_cols({
+            "pred_elo_target": y_hat,
+            "fighter_elo": curr_fighter_powers,
+            "opponent_elo": curr_opponent_powers,
+        })
+        return test_df[["fight_id", "FighterID_espn", "OpponentID_espn"]]\
+            .assign(**elo_feature_cols)
+
+class MultiRealEloEstimator(MultiEloMixin, RealEloEstimator):
+    """
+    Estimates elo scores for several real-valued, symmetric score differences
+    in one pass. See MultiEloMixin.
+    """
+    pass
+
+class MultiBinaryEloEstimator(MultiEloMixin, BinaryEloEstimator):
+    """
+    Estimates elo scores for several {0,1}-valued outcomes in one pass.
+    See MultiEloMixin.
+    """
+    pass
+
+class EloState(object):
+    """
+    The current powers of a fitted BaseEloEstimator (or MultiEloMixin
+    estimator), detached from its training data. Use update() to fold in
+    new events one at a time, rather than refitting on the whole history,
+    and predict() to get features for upcoming fights.
+
+    Example:
+        estimator = BinaryEloEstimator("win_target")
+        estimator.fit(train_df)
+        estimator.get_state().save("data/win_elo_state.pkl")
+        # later, once the next card has happened
+        state = EloState.load("data/win_elo_state.pkl")
+        event_feat_df = state.update(event_df)
+        upcoming_feat_df = state.predict(upcoming_df)
+    """
+
+    def __init__(self, estimator:BaseEloEstimator):
+        # keep the estimator around for its update rule, but not its
+        # (potentially huge) elo_feature_df
+        self.estimator = copy.copy(estimator)
+        self.estimator.elo_feature_df = None
+        self.estimator._fighter_powers = None
+        # a copy, since new fighters get appended to it
+        self.fighter_index = estimator.fighter_index.copy()
+        self.fighter_powers = estimator._fighter_powers.copy()
+
+    def save(self, path:str):
+        with open(path, "wb") as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def load(path:str):
+        with open(path, "rb") as f:
+            return pickle.load(f)
+
+    def add_fighters(self, fighter_ids:pd.Series):
+        """
+        Start any fighters we haven't seen before from a power of 0.
+        """
+        self.fighter_index.add(fighter_ids)
+        n_new = len(self.fighter_index) - len(self.fighter_powers)
+        if n_new > 0:
+            new_powers = np.zeros((n_new,) + self.fighter_powers.shape[1:])
+            self.fighter_powers = np.concatenate([self.fighter_powers, new_powers])
+
+    def _get_inds(self, df:pd.DataFrame):
+        self.add_fighters(pd.concat([df["FighterID_espn"], df["OpponentID_espn"]]))
+        return (self.fighter_index.get_inds(df["FighterID_espn"]),
+                self.fighter_index.get_inds(df["OpponentID_espn"]))
+
+    def _get_elo_feature_df(self, df:pd.DataFrame, elo_arrays:dict):
+        key_df = df[["fight_id", "FighterID_espn", "OpponentID_espn"]]
+        if isinstance(self.estimator, MultiEloMixin):
+            return key_df.assign(**self.estimator._get_elo_feature_cols(elo_arrays))
+        return key_df.assign(**elo_arrays)
+
+    def update(self, event_df:pd.DataFrame):
+        """
+        Fold in new fights, eg the latest card. Assuming that the data is
+        "doubled", like for BaseEloEstimator.fit, and that it's all later
+        than the fights the state has already seen. Costs O(len(event_df)).
+        Returns the same elo features that fit() would have given these rows.
+        """
+        assert (event_df["fight_id"].value_counts() == 2).all()
+        # same as BaseEloEstimator.fit, each fight's two rows are adjacent
+        event_df = event_df.sort_values(["fight_id", "FighterID_espn", "OpponentID_espn"])
+        fighter_inds, opponent_inds = self._get_inds(event_df)
+        if isinstance(self.estimator, MultiEloMixin):
+            y = event_df[self.estimator.target_cols].values.astype(float)
+        else:
+            y = event_df[self.estimator.target_col].values
+        elo_arrays = self.estimator._fit_doubled_arrays(
+            self.fighter_powers, fighter_inds, opponent_inds, event_df["Date"].values,
+            y, self.estimator.extract_features(event_df),
+        )
+        return self._get_elo_feature_df(event_df, elo_arrays)
+
+    def predict(self, test_df:pd.DataFrame):
+        """
+        Elo features for upcoming fights, given the current powers. test_df
+        needn't be doubled. Fighters we haven't seen start from a power of 0.
+        """
+        fighter_inds, opponent_inds = self._get_inds(test_df)
+        fighter_elo = self.fighter_powers[fighter_inds]
+        opponent_elo = self.fighter_powers[opponent_inds]
+        y_hat = self.estimator.predict_given_powers(
+            fighter_elo, opponent_elo, self.estimator.extract_features(test_df)
+        )
+        return self._get_elo_feature_df(test_df, {
+            "pred_elo_target": y_hat,
+            "fighter_elo": fighter_elo,
+            "opponent_elo": opponent_elo,
+        })
+
 class AccEloEstimator(object):
     
     def __init__(self, landed_col, attempt_col, alpha=0.5):
         self.landed_col = landed_col
         self.attempt_col = attempt_col
         self.alpha = alpha
-        self.fighter_ids = None
+        # FighterIndex, possibly shared with other estimators
+        self.fighter_index = None
         self.fighter_ids_with_target = None
         self.useless_fighter_ids = None
-        self._fighter_encoder = None
         self._fighter_offense_powers = None
         self._fighter_defense_powers = None
         self._power_intercept = None
         self.elo_feature_df = None
         
     def transform_fighter_ids(self, fighter_ids:pd.Series):
-        return self._fighter_encoder.transform(fighter_ids.values.reshape(-1,1))
+        return self.fighter_index.one_hot(fighter_ids)
     
     def _fit_power_intercept(self, df:pd.DataFrame):
         keep_inds_fighter = df[[self.landed_col, self.attempt_col]].notnull().all(1)
@@ -290,63 +707,23 @@ class AccEloEstimator(object):
             (df[self.landed_col+"_opp"].isnull() | df[self.attempt_col+"_opp"].isnull())
         )
         df = df.loc[~drop_inds].copy()
-        fighter_id_mat = self.transform_fighter_ids(df["FighterID_espn"])
-        opponent_id_mat = self.transform_fighter_ids(df["OpponentID_espn"])
-        fighter_offense_elos = np.zeros(len(df))
-        fighter_defense_elos = np.zeros(len(df))
-        opponent_offense_elos = np.zeros(len(df))
-        opponent_defense_elos = np.zeros(len(df))
-        
-        fighter_offense_deltas = np.zeros(len(df))
-        opponent_offense_deltas = np.zeros(len(df))
+        fighter_inds = self.get_fighter_inds(df["FighterID_espn"])
+        opponent_inds = self.get_fighter_inds(df["OpponentID_espn"])
         
         y_fighter = df[self.landed_col].fillna(0).values
         n_fighter = df[self.attempt_col].fillna(0).values
-        # if he made >= 1 attempt, this does nothing. if he made 0 attempts, this does nothing
-        p_fighter = y_fighter / np.maximum(n_fighter, 1) 
-        p_fighter = np.minimum(p_fighter, 1) # I'm paranoid
         # if stats are missing, just treat it like it's unobserved
         y_opponent = df[self.landed_col+"_opp"].fillna(0).values
         n_opponent = df[self.attempt_col+"_opp"].fillna(0).values
-        p_opponent = y_opponent / np.maximum(n_opponent, 1)
-        p_opponent = np.minimum(p_opponent, 1)
-        for i in tqdm(range(df.shape[0])):
-            fighter_id_vec = fighter_id_mat[i]
-            opponent_id_vec = opponent_id_mat[i]
-            fighter_offense_elos[i] = self._fighter_offense_powers * fighter_id_vec.T
-            fighter_defense_elos[i] = self._fighter_defense_powers * fighter_id_vec.T
-            opponent_offense_elos[i] = self._fighter_offense_powers * opponent_id_vec.T
-            opponent_defense_elos[i] = self._fighter_defense_powers * opponent_id_vec.T
-            
-            p_fighter_hat = expit(fighter_offense_elos[i] - 
-                                    opponent_defense_elos[i] + 
-                                    self._power_intercept)
-            p_opponent_hat = expit(opponent_offense_elos[i] - 
-                                     fighter_defense_elos[i] + 
-                                     self._power_intercept)
-            
-            # delta is oriented in the direction of the fighter i guess
-            # update the fighter's offense and opponent's defense
-            delta_p_fighter_landed = self.alpha * (y_fighter[i] - (n_fighter[i] * p_fighter_hat))
-            self._fighter_offense_powers += (0.5 * delta_p_fighter_landed * fighter_id_vec)
-            self._fighter_defense_powers -= (0.5 * delta_p_fighter_landed * opponent_id_vec)
-            delta_p_opponent_landed = self.alpha * (y_opponent[i] - (n_opponent[i] * p_opponent_hat))
-            self._fighter_offense_powers += (0.5 * delta_p_opponent_landed * opponent_id_vec)
-            self._fighter_defense_powers -= (0.5 * delta_p_opponent_landed * fighter_id_vec)
-
-            # w = self.alpha * np.sqrt(n_fighter[i] / (p_fighter_hat * (1 - p_fighter_hat)))
-            # delta_p_fighter_landed = w * (p_fighter[i] - p_fighter_hat)
-            # self._fighter_offense_powers += (0.5 * delta_p_fighter_landed * fighter_id_vec)
-            # self._fighter_defense_powers -= (0.5 * delta_p_fighter_landed * opponent_id_vec)
-
-            # w = self.alpha * np.sqrt(n_opponent[i] / (p_opponent_hat * (1 - p_opponent_hat)))
-            # delta_p_opponent_landed = w * (p_opponent[i] - p_opponent_hat)
-            
-            # self._fighter_offense_powers += (0.5 * delta_p_opponent_landed * opponent_id_vec)
-            # self._fighter_defense_powers -= (0.5 * delta_p_opponent_landed * fighter_id_vec)
-            
-            fighter_offense_deltas[i] = delta_p_fighter_landed
-            opponent_offense_deltas[i] = delta_p_opponent_landed
+        (
+            fighter_offense_elos, fighter_defense_elos,
+            opponent_offense_elos, opponent_defense_elos,
+            fighter_offense_deltas, opponent_offense_deltas,
+        ) = _acc_elo_kernel(
+            fighter_inds, opponent_inds, y_fighter, n_fighter, y_opponent, n_opponent,
+            self._fighter_offense_powers, self._fighter_defense_powers,
+            self._power_intercept, self.alpha,
+        )
         
         updated_fighter_offense_elos = fighter_offense_elos + (fighter_offense_deltas / 2)
         updated_fighter_defense_elos = fighter_defense_elos - (opponent_offense_deltas / 2)
@@ -389,7 +766,7 @@ class AccEloEstimator(object):
         df_with_target = elo_df.loc[~drop_inds].copy()
         fighter_ids_with_target = set(df_with_target["FighterID_espn"]) | \
                                   set(df_with_target["OpponentID_espn"])
-        useless_fighter_ids = set(self.fighter_ids) - fighter_ids_with_target
+        useless_fighter_ids = set(self.fighter_index.fighter_ids) - fighter_ids_with_target
         self.fighter_ids_with_target = pd.Series(sorted(fighter_ids_with_target))
         if not elo_df[[self.landed_col, self.attempt_col, 
                     self.landed_col+"_opp", self.attempt_col+"_opp"]].isnull().any().any():
@@ -406,35 +783,46 @@ class AccEloEstimator(object):
         elo_df.loc[is_useless_opponent, ['opponent_offense_elo', 'updated_opponent_offense_elo',
                                          'opponent_defense_elo', 'updated_opponent_defense_elo']] = 0
         # for fighters who eventually logged the target statistic, we start from 0,
-        # and forward-fill their most recent elo score
-        for fighter_id in tqdm(fighter_ids_with_target):
-            is_fighter_bool  = elo_df["FighterID_espn"] == fighter_id
-            is_opponent_bool = elo_df["OpponentID_espn"] == fighter_id
-            is_fighter_ind = elo_df.index[is_fighter_bool]
-            is_opponent_ind = elo_df.index[is_opponent_bool]
+        # and forward-fill their most recent elo score.
+        # Stack the fighter and opponent sides into one long frame with a row per
+        # (fight, fighter), in the same row order that _fit_workhorse used, so
+        # every fighter's career is a single groupby-ffill
+        n_rows = len(elo_df)
+        long_df = pd.DataFrame({
+            "fighter_id": np.concatenate([elo_df["FighterID_espn"].values,
+                                          elo_df["OpponentID_espn"].values]),
+            "row": np.tile(np.arange(n_rows), 2),
+            "is_fighter": np.repeat([True, False], n_rows),
+        })
+        for side in ["offense", "defense"]:
+            long_df[f"{side}_elo"] = np.concatenate([
+                elo_df[f"fighter_{side}_elo"].values, elo_df[f"opponent_{side}_elo"].values
+            ])
+            long_df[f"updated_{side}_elo"] = np.concatenate([
+                elo_df[f"updated_fighter_{side}_elo"].values,
+                elo_df[f"updated_opponent_{side}_elo"].values
+            ])
+        long_df = long_df.loc[long_df["fighter_id"].isin(fighter_ids_with_target)]
+        long_df = long_df.sort_values("row", kind="stable")
+        is_first_fight = ~long_df["fighter_id"].duplicated()
+        for side in ["offense", "defense"]:
             # this is tricky - for fights that occurred after the statistic was recorded,
             # we want to forward-fill the fighter's UPDATED elo scores, not the fighter's
             # elo score prior to the fight where the stat was recorded
-            for side in ["offense", "defense"]:
-                updated_fighter_elo = (
-                    elo_df[f"updated_fighter_{side}_elo"] * is_fighter_bool +
-                    elo_df[f"updated_opponent_{side}_elo"] * is_opponent_bool
-                ).loc[is_fighter_bool | is_opponent_bool]
-                # elo scores always start with 0
-                updated_fighter_elo.iloc[0] = np.nan_to_num(updated_fighter_elo.iloc[0], 0)
-                updated_fighter_elo = updated_fighter_elo.fillna(method='ffill')
-                # fill NaNs in fighter_elo and opponent_elo columns with now-ffilled updated_fighter_elo
-                elo_df.loc[is_fighter_ind, f"fighter_{side}_elo"] = \
-                    elo_df.loc[is_fighter_ind, f"fighter_{side}_elo"]\
-                        .fillna(updated_fighter_elo)
-                elo_df.loc[is_opponent_ind, f"opponent_{side}_elo"] = \
-                    elo_df.loc[is_opponent_ind, f"opponent_{side}_elo"]\
-                        .fillna(updated_fighter_elo)
+            updated_elo = long_df[f"updated_{side}_elo"].copy()
+            # elo scores always start with 0
+            updated_elo.loc[is_first_fight] = updated_elo.loc[is_first_fight].fillna(0)
+            updated_elo = updated_elo.groupby(long_df["fighter_id"]).ffill()
+            # fill NaNs in fighter_elo and opponent_elo columns with now-ffilled updated_elo
+            curr_elo = long_df[f"{side}_elo"].fillna(updated_elo)
+            for is_fighter, prefix in [(True, "fighter"), (False, "opponent")]:
+                is_side = (long_df["is_fighter"] == is_fighter).values
+                rows = long_df["row"].values[is_side]
+                elo_df.iloc[rows, elo_df.columns.get_loc(f"{prefix}_{side}_elo")] = \
+                    curr_elo.values[is_side]
                 # might as well fill NaNs in updated_fighter_elo and updated_opponent_elo columns
-                elo_df.loc[is_fighter_ind, f"updated_fighter_{side}_elo"] = \
-                    updated_fighter_elo.loc[is_fighter_ind]
-                elo_df.loc[is_opponent_ind, f"updated_opponent_{side}_elo"] = \
-                    updated_fighter_elo.loc[is_opponent_ind]
+                elo_df.iloc[rows, elo_df.columns.get_loc(f"updated_{prefix}_{side}_elo")] = \
+                    updated_elo.values[is_side]
         assert elo_df[["fighter_offense_elo", "opponent_offense_elo"]].isnull().any().any() == False, \
             elo_df[["fighter_offense_elo", "opponent_offense_elo"]].isnull().mean()
         assert elo_df[["fighter_defense_elo", "opponent_defense_elo"]].isnull().any().any() == False, \
@@ -443,19 +831,24 @@ class AccEloEstimator(object):
         elo_df["p_opponent_hat"] = expit(elo_df["opponent_offense_elo"] - elo_df["fighter_defense_elo"])
         return elo_df
 
+    def get_fighter_inds(self, fighter_ids:pd.Series) -> np.ndarray:
+        """
+        Get the integer index of each fighter into the power vectors.
+        """
+        return self.fighter_index.get_inds(fighter_ids)
+
     def fit_fighter_encoder(self, df):
-        self.fighter_ids = sorted(set(df["FighterID_espn"]) | set(df["OpponentID_espn"]))
-        categories = np.array(self.fighter_ids).reshape(-1,1)
-        self._fighter_encoder = OneHotEncoder()
-        self._fighter_encoder.fit(categories)
+        self.fighter_index = FighterIndex.from_df(df)
         
     def fit(self, df:pd.DataFrame):
         self._fit_power_intercept(df)
-        if self.fighter_ids is None:
+        if self.fighter_index is None:
             self.fit_fighter_encoder(df) 
-        self._fighter_offense_powers = np.zeros(len(self.fighter_ids))
-        self._fighter_defense_powers = np.zeros(len(self.fighter_ids))
-        categories = np.array(self.fighter_ids).reshape(-1,1)
+        else:
+            # a shared index may not have seen all of these fighters yet
+            self.fighter_index.add(pd.concat([df["FighterID_espn"], df["OpponentID_espn"]]))
+        self._fighter_offense_powers = np.zeros(len(self.fighter_index))
+        self._fighter_defense_powers = np.zeros(len(self.fighter_index))
         
         fitted_elo_df = self._fit_workhorse(df)
         # okay this is the hard part - ffilling
@@ -468,13 +861,27 @@ class AccEloEstimator(object):
         self.elo_feature_df = self._fit_ffill(elo_df)
         return self.elo_feature_df
     
+    def predict_matchup_matrix(self, fighter_ids, out_path=None):
+        """
+        (n, n) matrix whose [i, j] entry is the predicted probability that
+        fighter_ids[i] lands an attempt against fighter_ids[j].
+        Fighters the powers weren't fit on have powers of 0.
+        out_path: if given, write the matrix to a float32 .npy memmap there.
+        """
+        fighter_ids = pd.Series(fighter_ids)
+        offense_powers = self.fighter_index.get_powers(fighter_ids, self._fighter_offense_powers)
+        defense_powers = self.fighter_index.get_powers(fighter_ids, self._fighter_defense_powers)
+        return _expit_matchup_matrix(offense_powers + self._power_intercept,
+                                     defense_powers, out_path=out_path)
+
     def predict(self, df):
-        fighter_id_mat = self.transform_fighter_ids(df["FighterID_espn"])
-        opponent_id_mat = self.transform_fighter_ids(df["OpponentID_espn"])
-        fighter_offense_elos = self._fighter_offense_powers * fighter_id_mat.T
-        fighter_defense_elos = self._fighter_defense_powers * fighter_id_mat.T
-        opponent_offense_elos = self._fighter_offense_powers * opponent_id_mat.T
-        opponent_defense_elos = self._fighter_defense_powers * opponent_id_mat.T
+        # look the powers up by index. Fighters the powers weren't fit on
+        # have powers of 0
+        get_powers = self.fighter_index.get_powers
+        fighter_offense_elos = get_powers(df["FighterID_espn"], self._fighter_offense_powers)
+        fighter_defense_elos = get_powers(df["FighterID_espn"], self._fighter_defense_powers)
+        opponent_offense_elos = get_powers(df["OpponentID_espn"], self._fighter_offense_powers)
+        opponent_defense_elos = get_powers(df["OpponentID_espn"], self._fighter_defense_powers)
 
         p_fighter_hat = expit(fighter_offense_elos - 
                                 opponent_defense_elos + 
@@ -486,8 +893,8 @@ class AccEloEstimator(object):
             "fight_id": df["fight_id"],
             "FighterID_espn": df["FighterID_espn"],
             "OpponentID_espn": df["OpponentID_espn"],
-            "pred_p_fighter_landed": p_fighter_hat.A1,
-            "pred_p_opponent_landed": p_opponent_hat.A1,
+            "pred_p_fighter_landed": p_fighter_hat,
+            "pred_p_opponent_landed": p_opponent_hat,
         })
     
     def get_fighter_career_elos(self, fighter_id):
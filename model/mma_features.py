@@ -18,34 +18,70 @@ Example:
     elo_feat_df = elo_wrapper.fit_predict(train_df, test_df)
 
 Notes:
-    - The fit_*() methods don't assume that the data is "doubled" - i.e.
-    that each fight is represented twice, once for each (Fighter, Opponent) 
-    permutation. So in methods like fit_transform_all(), the data is 
-    deduped, then in _fit_transform(), the data is doubled! Very silly.
+    - fit_transform_all() expects "doubled" data - i.e. that each fight is
+    represented twice, once for each (Fighter, Opponent) permutation - and
+    returns doubled features. Internally, the elo estimators gather and
+    update the powers once per fight. Each of a fight's two rows still gets
+    its own prediction from its own target and features, and the fight's
+    update is the average of the two rows' updates, so the rows needn't
+    mirror each other (see BaseEloEstimator._fit_doubled_arrays).
 """
 
-# import numpy as np 
+import numpy as np
 import pandas as pd 
 from model.mma_elo_model import RealEloEstimator, BinaryEloEstimator, \
-    AccEloEstimator, BinaryEloErrorEstimator
+    AccEloEstimator, BinaryEloErrorEstimator, MultiRealEloEstimator, MultiBinaryEloEstimator
 from model.mma_coop_model import RealCoopEstimator, BinaryCoopEstimator
 # from model.exact_elo_model import RealExactEloEstimator, BinaryExactEloEstimator, \
 #     RealExactEloErrorEstimator, BinaryExactEloErrorEstimator
-from model.exact_elo_model import RealFighterPowerEstimator, BinaryFighterPowerEstimator
+from model.exact_elo_model import RealFighterPowerEstimator, BinaryFighterPowerEstimator, \
+    MultiRealFighterPowerEstimator
+from model.fighter_index import FighterIndex
 from sklearn.decomposition import PCA
 from scipy.special import expit, logit
 from abc import ABC, abstractmethod
 
 from concurrent.futures import ProcessPoolExecutor
+from joblib import Parallel, delayed
 from tqdm import tqdm
 
 
+def _fit_elo_estimator(elo_estimator, df):
+    # module-level so that joblib can send it to worker processes
+    elo_estimator.fit(df)
+    return elo_estimator
+
+def _fit_transform_all_estimator(estimator, df, **kwargs):
+    # module-level so that joblib can send it to worker processes
+    return estimator.fit_transform_all(df, **kwargs)
+
+
 class BaseEloWrapper(ABC):
+    # estimator that fits several (target, alpha) columns in one pass, if any
+    multi_estimator_class = None
 
-    def __init__(self, elo_alphas:dict):
+    def __init__(self, elo_alphas:dict, n_jobs=1, feature_cache=None, fighter_index=None):
         # elo_alphas maps target_col --> alpha
         self.elo_alphas = elo_alphas
+        # number of targets to fit concurrently in fit_transform_all
+        self.n_jobs = n_jobs
+        # optional FeatureCache, consulted by fit_transform_all
+        self.feature_cache = feature_cache
+        # FighterIndex shared by all the estimators. Built from the data if
+        # not given
+        self.fighter_index = fighter_index
         self.fitted_elo_estimators = dict()
+
+    def get_fighter_index(self, df):
+        """
+        Returns the shared FighterIndex, after making sure that it has
+        every fighter in df.
+        """
+        if self.fighter_index is None:
+            self.fighter_index = FighterIndex.from_df(df)
+        else:
+            self.fighter_index.add(pd.concat([df["FighterID_espn"], df["OpponentID_espn"]]))
+        return self.fighter_index
     
     def get_preprocessed(self, df):
         """
@@ -53,34 +89,104 @@ class BaseEloWrapper(ABC):
         """
         return df.copy()
 
+    def get_cache_params(self):
+        """
+        Everything besides the input data that determines the output of
+        fit_transform_all. Used to key the feature cache.
+        """
+        return {
+            "wrapper": type(self).__name__,
+            "estimator_class": getattr(self.estimator_class, "__name__", None),
+            "elo_alphas": self.elo_alphas,
+        }
+
     def fit_transform_all(self, df):
         """
         Assuming that the data is "doubled" - i.e. that each fight is
         represented twice, once for each (Fighter, Opponent) permutation.
         Returns a dataframe with the same number of rows as the input df.
+        If there's a feature cache, the features are read from it when
+        possible, in which case fitted_elo_estimators isn't populated.
         df: pd.DataFrame
         """
+        if self.feature_cache is None:
+            return self._fit_transform_all(df)
+        return self.feature_cache.get_or_compute(
+            df, self.get_cache_params(), self._fit_transform_all
+        )
+
+    def _fit_transform_all(self, df):
         assert (df["fight_id"].value_counts() == 2).all()
         prep_df = self.get_preprocessed(df)
-        elo_feat_df = df[["FighterID_espn", "OpponentID_espn", "fight_id"]].copy()
+        key_cols = ["FighterID_espn", "OpponentID_espn", "fight_id"]
+        fighter_index = self.get_fighter_index(prep_df)
+        elo_estimators = []
         for target_col, alpha in self.elo_alphas.items():
             print(f"getting elo features for {target_col}")
             elo_estimator = self.estimator_class(target_col, alpha)
-            elo_estimator.fit(prep_df)
-            elo_feat_df = elo_feat_df.merge(
-                elo_estimator.elo_feature_df,
-                on=["FighterID_espn", "OpponentID_espn", "fight_id"],
-                how="left"
-            ).rename(columns={
-                "pred_elo_target": f"pred_elo_{target_col}",
-                "fighter_elo": f"fighter_elo_{target_col}",
-                "opponent_elo": f"opponent_elo_{target_col}",
-                "updated_fighter_elo": f"updated_fighter_elo_{target_col}",
-                "updated_opponent_elo": f"updated_opponent_elo_{target_col}",
-            })
+            elo_estimator.fighter_index = fighter_index
+            elo_estimators.append(elo_estimator)
+        # the targets are independent, so fit them in parallel
+        elo_estimators = Parallel(n_jobs=self.n_jobs)(
+            delayed(_fit_elo_estimator)(elo_estimator, prep_df)
+            for elo_estimator in elo_estimators
+        )
+        # every elo_feature_df has the same rows in the same order, so
+        # put the columns side by side and merge just once
+        elo_feat_df_list = [elo_estimators[0].elo_feature_df[key_cols]]
+        for target_col, elo_estimator in zip(self.elo_alphas, elo_estimators):
+            elo_feat_df_list.append(
+                elo_estimator.elo_feature_df.drop(columns=key_cols).rename(columns={
+                    "pred_elo_target": f"pred_elo_{target_col}",
+                    "fighter_elo": f"fighter_elo_{target_col}",
+                    "opponent_elo": f"opponent_elo_{target_col}",
+                    "updated_fighter_elo": f"updated_fighter_elo_{target_col}",
+                    "updated_opponent_elo": f"updated_opponent_elo_{target_col}",
+                })
+            )
             self.fitted_elo_estimators[target_col] = elo_estimator
+        elo_feat_df = df[key_cols].merge(
+            pd.concat(elo_feat_df_list, axis=1),
+            on=key_cols,
+            how="left"
+        )
         return elo_feat_df
     
+    def fit_transform_alpha_grid(self, df, alpha_grid):
+        """
+        Same as calling fit_transform_all once for each alpha in alpha_grid,
+        with every target's alpha set to that value. But every (target, alpha)
+        pair is fit in a single pass over the fights, with multi_estimator_class.
+        Returns a dict mapping alpha --> elo_feat_df.
+        df: pd.DataFrame, assumed to be "doubled"
+        """
+        assert (df["fight_id"].value_counts() == 2).all()
+        prep_df = self.get_preprocessed(df)
+        key_cols = ["FighterID_espn", "OpponentID_espn", "fight_id"]
+        target_cols = list(self.elo_alphas)
+        print(f"getting elo features for {target_cols}, alphas {list(alpha_grid)}")
+        elo_estimator = self.multi_estimator_class(
+            target_cols=[target_col for _ in alpha_grid for target_col in target_cols],
+            alphas=[alpha for alpha in alpha_grid for _ in target_cols],
+            col_suffixes=[f"{target_col}_alpha_{i}" for i in range(len(alpha_grid))
+                          for target_col in target_cols],
+        )
+        elo_estimator.fighter_index = self.get_fighter_index(prep_df)
+        elo_estimator.fit(prep_df)
+        fitted_elo_df = elo_estimator.elo_feature_df
+        elo_feat_dfs = dict()
+        for i, alpha in enumerate(alpha_grid):
+            # same columns, in the same order, as fit_transform_all
+            elo_feat_df = fitted_elo_df[key_cols].copy()
+            for target_col in target_cols:
+                elo_feat_df[target_col] = fitted_elo_df[target_col]
+                for col in ["pred_elo", "fighter_elo", "opponent_elo",
+                            "updated_fighter_elo", "updated_opponent_elo"]:
+                    elo_feat_df[f"{col}_{target_col}"] = \
+                        fitted_elo_df[f"{col}_{target_col}_alpha_{i}"]
+            elo_feat_dfs[alpha] = df[key_cols].merge(elo_feat_df, on=key_cols, how="left")
+        return elo_feat_dfs
+
     def fit_predict(self, train_df, test_df):
         """
         Assuming that train_df is "doubled" - i.e. that each fight is
@@ -95,11 +201,9 @@ class BaseEloWrapper(ABC):
         for target_col, alpha in self.elo_alphas.items():
             print(f"getting elo features for {target_col}")
             elo_estimator = self.estimator_class(target_col, alpha)
-            fighter_ids = pd.concat([
-                prep_train_df["FighterID_espn"], prep_train_df["OpponentID_espn"],
-                prep_test_df["FighterID_espn"], prep_test_df["OpponentID_espn"]
-            ]).unique()
-            elo_estimator.fit_fighter_encoder(pd.Series(fighter_ids))
+            elo_estimator.fighter_index = self.get_fighter_index(
+                pd.concat([prep_train_df, prep_test_df])
+            )
             elo_estimator.fit(prep_train_df)
             train_feat_df = train_feat_df.merge(
                 elo_estimator.elo_feature_df,
@@ -126,28 +230,61 @@ class BaseEloWrapper(ABC):
     
 
 class RealEloWrapper(BaseEloWrapper):
+    """
+    Fits all the targets in a single pass with MultiRealEloEstimator, so
+    there's nothing to parallelize: n_jobs is accepted for the same signature
+    as BaseEloWrapper, but has no effect.
+    """
     estimator_class = RealEloEstimator
+    multi_estimator_class = MultiRealEloEstimator
+
+    def _fit_transform_all(self, df):
+        """
+        Assuming that the data is "doubled" - i.e. that each fight is
+        represented twice, once for each (Fighter, Opponent) permutation.
+        Returns a dataframe with the same number of rows as the input df.
+        All the targets are fit in a single pass with MultiRealEloEstimator,
+        so this costs about as much as fitting one target.
+        df: pd.DataFrame
+        """
+        assert (df["fight_id"].value_counts() == 2).all()
+        prep_df = self.get_preprocessed(df)
+        key_cols = ["FighterID_espn", "OpponentID_espn", "fight_id"]
+        print(f"getting elo features for {list(self.elo_alphas)}")
+        elo_estimator = self.multi_estimator_class(list(self.elo_alphas),
+                                                   list(self.elo_alphas.values()))
+        elo_estimator.fighter_index = self.get_fighter_index(prep_df)
+        elo_estimator.fit(prep_df)
+        for target_col in self.elo_alphas:
+            self.fitted_elo_estimators[target_col] = elo_estimator
+        elo_feat_df = df[key_cols].merge(
+            elo_estimator.elo_feature_df,
+            on=key_cols,
+            how="left"
+        )
+        return elo_feat_df
 
 class BinaryEloWrapper(BaseEloWrapper):
     estimator_class = BinaryEloEstimator
+    multi_estimator_class = MultiBinaryEloEstimator
 
 
-def _fit_transform_all_helper(date, estimator, df):
-    # should be easily serializable
-    train_df = df.query(f"Date < '{date}'")
-    test_df = df.query(f"Date == '{date}'")
-    return test_df[["fight_id", "FighterID_espn", "OpponentID_espn",
-                    estimator.target_col]].assign(
-                pred_elo_target=estimator.fit_predict(train_df, test_df)
-            )
-
 class BaseFighterPowerWrapper(BaseEloWrapper):
     # Use the same signature as the BaseEloWrapper
+    # fits all the targets together, if the estimator supports it
+    multi_estimator_class = None
 
-    def __init__(self, target_cols, static_feat_cols=None, **estimator_kwargs):
+    def __init__(self, target_cols, static_feat_cols=None, n_jobs=1, fighter_index=None,
+                 **estimator_kwargs):
         self.target_cols = target_cols
         self.estimator_kwargs = estimator_kwargs
         self.static_feat_cols = static_feat_cols
+        # number of targets to fit concurrently in fit_transform_all. Only
+        # used when each target gets its own estimator: with a
+        # multi_estimator_class, all the targets are fit together, and only
+        # fit_transform_all's n_date_jobs applies
+        self.n_jobs = n_jobs
+        self.fighter_index = fighter_index
 
     def get_preprocessed(self, df):
         """
@@ -155,7 +292,8 @@ class BaseFighterPowerWrapper(BaseEloWrapper):
         """
         return df.copy()
     
-    def fit_transform_all(self, df, min_date=pd.to_datetime("2023-01-01"), fast=False):
+    def fit_transform_all(self, df, min_date=pd.to_datetime("2023-01-01"), fast=False,
+                          incremental=False, n_date_jobs=1):
         """
         Assuming that the data is "doubled" - i.e. that each fight is
         represented twice, once for each (Fighter, Opponent) permutation.
@@ -163,26 +301,74 @@ class BaseFighterPowerWrapper(BaseEloWrapper):
         df: pd.DataFrame
         min_date: For each date d starting from min_date, fit the model on all data prior to d,
             and predict the outcome of all fights on date d.
+        fast: If True, collapse fighters with few previous fights into a single
+            column for each date's fit. See BaseFighterPowerEstimator.fit_transform_all.
+        incremental: If True, warm-start each date's fit from the previous date's fit.
+            See BaseFighterPowerEstimator.fit_transform_all.
+            fast and incremental can't both be True: that raises a ValueError.
+        n_date_jobs: number of processes to split each target's dates between.
+            See BaseFighterPowerEstimator.fit_transform_all. With a
+            multi_estimator_class, this is the only parallelism, and
+            self.n_jobs is ignored.
         """
-        print("trying again with a just one estimator, calling estimator.fit_transform_all, which just uses a for loop")
+        if fast and incremental:
+            raise ValueError("fast=True can't be combined with incremental=True")
         assert (df["fight_id"].value_counts() == 2).all()
+        # sort by date up front (stably, which doesn't change any predictions),
+        # so that incremental fits needn't permute the shared design matrix
         prep_df = self.get_preprocessed(df)
-        feat_df = df[["FighterID_espn", "OpponentID_espn", "fight_id"]].copy()
+        prep_df = prep_df.iloc[np.argsort(prep_df["Date"].values, kind="stable")]
+        key_cols = ["FighterID_espn", "OpponentID_espn", "fight_id"]
         # make sure all the target_cols are in the data
         assert all([col in prep_df.columns for col in self.target_cols])
+        fighter_index = self.get_fighter_index(prep_df)
+        if self.multi_estimator_class is not None:
+            if self.n_jobs != 1:
+                print(f"n_jobs={self.n_jobs} is ignored, all the targets are fit together. "
+                      "Use n_date_jobs to parallelize over dates")
+            print(f"fitting {self.target_cols}")
+            estimator = self.multi_estimator_class(self.target_cols,
+                                                   static_feat_cols=self.static_feat_cols,
+                                                   **self.estimator_kwargs)
+            estimator.fighter_index = fighter_index
+            pred_df = estimator.fit_transform_all(prep_df, min_date=min_date, fast=fast,
+                                                  incremental=incremental, n_jobs=n_date_jobs)
+            # already has the same columns as the per-target fits below
+            return df[key_cols].merge(pred_df, on=key_cols, how="left")
+        estimators = []
         for target_col in self.target_cols:
             print(f"fitting {target_col}")
             estimator = self.estimator_class(target_col, static_feat_cols=self.static_feat_cols,
-                                                **self.estimator_kwargs)
-            curr_pred_df = estimator.fit_transform_all(prep_df, min_date=min_date, fast=fast)
-            curr_pred_df = curr_pred_df.rename(columns={"pred_elo_target": f"pred_{target_col}"})
-            feat_df = feat_df.merge(curr_pred_df, 
-                                    on=["FighterID_espn", "OpponentID_espn", "fight_id"],
-                                    how="left")
+                                             **self.estimator_kwargs)
+            estimator.fighter_index = fighter_index
+            estimators.append(estimator)
+        # the design matrix doesn't depend on the target, so build it once.
+        # The estimators only read it, and joblib memmaps its arrays rather
+        # than copying them to each worker
+        X = estimators[0].get_design_matrix(prep_df)
+        # the targets are independent, so fit them in parallel
+        pred_df_list = Parallel(n_jobs=self.n_jobs)(
+            delayed(_fit_transform_all_estimator)(estimator, prep_df, min_date=min_date,
+                                                  fast=fast, incremental=incremental, X=X,
+                                                  n_jobs=n_date_jobs)
+            for estimator in estimators
+        )
+        # every pred_df has the same rows in the same order, so
+        # put the columns side by side and merge just once
+        feat_df_list = [pred_df_list[0][key_cols]]
+        for target_col, curr_pred_df in zip(self.target_cols, pred_df_list):
+            feat_df_list.append(
+                curr_pred_df.drop(columns=key_cols)
+                    .rename(columns={"pred_elo_target": f"pred_{target_col}"})
+            )
+        feat_df = df[key_cols].merge(pd.concat(feat_df_list, axis=1),
+                                     on=key_cols,
+                                     how="left")
         return feat_df
 
 class RealFighterPowerWrapper(BaseFighterPowerWrapper):
     estimator_class = RealFighterPowerEstimator
+    multi_estimator_class = MultiRealFighterPowerEstimator
 
 class BinaryFighterPowerWrapper(BaseFighterPowerWrapper):
     estimator_class = BinaryFighterPowerEstimator
@@ -275,24 +461,42 @@ class BinaryCoopWrapper(BaseEloWrapper):
 
 class BinaryEloErrorWrapper(BaseEloWrapper):
 
-    def __init__(self, elo_alphas, init_score_col):
+    def __init__(self, elo_alphas, init_score_col, n_jobs=1, feature_cache=None,
+                 fighter_index=None):
         self.elo_alphas = elo_alphas
         self.init_score_col = init_score_col
+        self.n_jobs = n_jobs
+        self.feature_cache = feature_cache
+        self.fighter_index = fighter_index
         self.fitted_elo_estimators = dict()
         self.estimator_class = lambda target_col, alpha: BinaryEloErrorEstimator(
             target_col=target_col, alpha=alpha, init_score_col=init_score_col
         )
+
+    def get_cache_params(self):
+        return {
+            **super().get_cache_params(),
+            "estimator_class": "BinaryEloErrorEstimator",
+            "init_score_col": self.init_score_col,
+        }
             
 class PcaEloWrapper(RealEloWrapper):
+    """
+    Elo features for the principal components of target_cols. Like
+    RealEloWrapper, all the components are fit in one pass, and n_jobs has
+    no effect.
+    """
     
-    def __init__(self, n_pca, target_cols, alpha, conditional_var_col="gender"):
+    def __init__(self, n_pca, target_cols, alpha, conditional_var_col="gender", n_jobs=1,
+                 feature_cache=None, fighter_index=None):
         self.n_pca = n_pca
         self.target_cols = target_cols
         self.alpha = alpha
         self.conditional_var_col = conditional_var_col
         self.pca = None
         elo_alphas = {f"PC_{i}":alpha for i in range(n_pca)}
-        super().__init__(elo_alphas)
+        super().__init__(elo_alphas, n_jobs=n_jobs, feature_cache=feature_cache,
+                         fighter_index=fighter_index)
 
     def _fit_transform_pca(self, df):
         """
@@ -334,14 +538,27 @@ class PcaEloWrapper(RealEloWrapper):
         )
         return pca_df
 
-    def fit_transform_all(self, df):
+    def get_cache_params(self):
+        return {
+            **super().get_cache_params(),
+            "n_pca": self.n_pca,
+            "target_cols": list(self.target_cols),
+            "conditional_var_col": self.conditional_var_col,
+        }
+
+    def _fit_transform_all(self, df):
+        pca_df = self._fit_transform_pca(df)
+        return super()._fit_transform_all(pca_df)
+
+    def fit_transform_alpha_grid(self, df, alpha_grid):
         """
         Assuming that the data is "doubled" - i.e. that each fight is
         represented twice, once for each (Fighter, Opponent) permutation.
-        Returns a dataframe with the same number of rows as the input df.
-        df: pd.DataFrame"""
+        Returns a dict mapping alpha --> elo_feat_df. See
+        BaseEloWrapper.fit_transform_alpha_grid.
+        """
         pca_df = self._fit_transform_pca(df)
-        return super().fit_transform_all(pca_df)
+        return super().fit_transform_alpha_grid(pca_df, alpha_grid)
 
     def fit_predict(self, train_df, test_df):
         """
@@ -358,16 +575,45 @@ class PcaEloWrapper(RealEloWrapper):
 
 class AccEloWrapper(object):
     
-    def __init__(self, elo_alphas:dict):
+    def __init__(self, elo_alphas:dict, feature_cache=None, fighter_index=None):
         # elo_alphas maps (landed_col, attempt_col) --> alpha
         self.elo_alphas = elo_alphas
+        # optional FeatureCache, consulted by fit_transform_all
+        self.feature_cache = feature_cache
+        # FighterIndex shared by all the estimators. Built from the data if
+        # not given
+        self.fighter_index = fighter_index
         self.fitted_elo_estimators = dict()
-        
+
+    def get_fighter_index(self, df):
+        # same as BaseEloWrapper.get_fighter_index
+        if self.fighter_index is None:
+            self.fighter_index = FighterIndex.from_df(df)
+        else:
+            self.fighter_index.add(pd.concat([df["FighterID_espn"], df["OpponentID_espn"]]))
+        return self.fighter_index
+
+    def get_cache_params(self):
+        return {
+            "wrapper": type(self).__name__,
+            "estimator_class": AccEloEstimator.__name__,
+            "elo_alphas": self.elo_alphas,
+        }
+
     def fit_transform_all(self, df):
         """
         Assuming that the data is "doubled" - i.e. that each fight is
         represented twice, once for each (Fighter, Opponent) permutation.
+        If there's a feature cache, the features are read from it when
+        possible, in which case fitted_elo_estimators isn't populated.
         """
+        if self.feature_cache is None:
+            return self._fit_transform_all(df)
+        return self.feature_cache.get_or_compute(
+            df, self.get_cache_params(), self._fit_transform_all
+        )
+
+    def _fit_transform_all(self, df):
         assert (df["fight_id"].value_counts() == 2).all()
         df = df.drop_duplicates(subset=["fight_id"])
         # elo_feat_df = df[["fight_id"]].copy()
@@ -380,6 +626,7 @@ class AccEloWrapper(object):
             target_col = f"{landed_col}_{attempt_col}"
             print(f"getting elo features for {landed_col}/{attempt_col}")
             elo_estimator = AccEloEstimator(landed_col=landed_col, attempt_col=attempt_col, alpha=alpha)
+            elo_estimator.fighter_index = self.get_fighter_index(df)
             elo_estimator.fit(df)
             self.fitted_elo_estimators[target_col] = elo_estimator
             
@@ -401,6 +648,21 @@ class AccEloWrapper(object):
         elo_feat_df = pd.concat([elo_feat_df1, elo_feat_df2]).reset_index(drop=True)
         return elo_feat_df
     
+    def fit_transform_alpha_grid(self, df, alpha_grid):
+        """
+        Same as calling fit_transform_all once for each alpha in alpha_grid,
+        with every target's alpha set to that value.
+        Returns a dict mapping alpha --> elo_feat_df.
+        """
+        # AccEloEstimator's kernel is O(1) per fight, so one pass per alpha is cheap
+        elo_feat_dfs = dict()
+        for alpha in alpha_grid:
+            acc_ew = AccEloWrapper({cols: alpha for cols in self.elo_alphas},
+                                   feature_cache=self.feature_cache,
+                                   fighter_index=self.get_fighter_index(df))
+            elo_feat_dfs[alpha] = acc_ew.fit_transform_all(df)
+        return elo_feat_dfs
+
     def fit_predict(self, train_df, test_df):
         """
         train_df: pd.DataFrame, assumed to be "doubled"
@@ -418,7 +680,7 @@ class AccEloWrapper(object):
             target_col = f"{landed_col}_{attempt_col}"
             print(f"getting elo features for {landed_col}/{attempt_col}")
             elo_estimator = AccEloEstimator(landed_col=landed_col, attempt_col=attempt_col, alpha=alpha)
-            elo_estimator.fit_fighter_encoder(pd.concat([train_df, test_df]))
+            elo_estimator.fighter_index = self.get_fighter_index(pd.concat([train_df, test_df]))
             elo_estimator.fit(train_df)
             self.fitted_elo_estimators[target_col] = elo_estimator
             
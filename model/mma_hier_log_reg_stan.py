@@ -1,29 +1,25 @@
-import pystan 
 import numpy as np 
 import pandas as pd 
 from sklearn.decomposition import PCA
 from model.mma_log_reg_stan import SimpleSymmetricModel
 from scipy.special import expit, logit
 
+# As in mma_log_reg_stan.py, only the training data goes to Stan, and the
+# test data is predicted afterwards in NumPy
 hier_code = """
 
 data {
     int<lower=0> n;                     // number of data points in training data
-    int<lower=0> n2;                    // number of data points in test data
     int<lower=1> d;                     // explanatory variable dimension
     int<lower=0,upper=1> y[n];          // response variable
     real<lower=0> beta_prior_std;       // prior scale on beta mean across groups
     real<lower=0> intra_group_std;      // prior scale on beta, std dev of group's beta around mean
     
     vector[n] is_m;      // 0 if woman, 1 if man
-    vector[n2] is_m2;    // 0 if woman, 1 if man
     
     matrix[n, d] X;                     // explanatory variable
     vector[n] ml_logit;                   // logit of the opening money line
 
-    matrix[n2, d] X2;                   // test data
-    vector[n2] ml_logit2;                 // test data
-
 }
 
 parameters {
@@ -31,53 +27,57 @@ parameters {
     vector[d] beta_w;
 }
 
-transformed parameters {
-    vector[n] eta;
-    vector[n2] eta2;
-    eta = (
+model {
+    // linear predictor. Local to the model block, so it isn't saved with each draw
+    vector[n] eta = (
         ml_logit + 
         ((X * beta_m) .* is_m) + 
         ((X * beta_w) .* (1 - is_m))
-    );      // linear predictor
-    eta2 = (
-        ml_logit2 + 
-        ((X2 * beta_m) .* is_m2) + 
-        ((X2 * beta_w) .* (1 - is_m2))
-    );   // linear predictor for test data
-}
+    );
 
-model {
     beta_m ~ normal(0, beta_prior_std);
     beta_w ~ normal(beta_m, intra_group_std); // damn i hope this works
 
     y ~ bernoulli_logit(eta);
 }
-
-generated quantities {
-    vector[n2] y_pred;
-    
-    y_pred = inv_logit(eta2);  // y values predicted for test data
-}
 """
 
 class HierSymmetricModel(SimpleSymmetricModel):
+    map_param_names = ["beta_m", "beta_w"]
 
     def __init__(self, feat_cols, beta_prior_std=0.1, target_col="targetWin",
             p_fighter_implied_col="p_fighter_implied",
             gender_col="gender", intra_group_std=0.1,
-            mcmc=False, num_chains=4, num_samples=1000):
+            mcmc=False, num_chains=4, num_samples=1000, stan_opt=False, laplace=False):
         super().__init__(feat_cols, beta_prior_std, target_col,
             p_fighter_implied_col,
-            mcmc, num_chains, num_samples)
+            mcmc, num_chains, num_samples, stan_opt, laplace)
         self.intra_group_std = float(intra_group_std)
         self.gender_col = gender_col
         self.code = hier_code
 
+    def _get_map_problem(self, data):
+        """
+        eta = ml_logit + X (is_m * beta_m + (1 - is_m) * beta_w), so the
+        design matrix is [is_m * X, (1 - is_m) * X]. The prior
+        beta_m ~ N(0, beta_prior_std), beta_w ~ N(beta_m, intra_group_std)
+        has precision [[a + b, -b], [-b, b]] (times I), with
+        a = 1 / beta_prior_std^2 and b = 1 / intra_group_std^2.
+        """
+        is_m = data["is_m"].reshape(-1, 1)
+        X = np.concatenate([is_m * data["X"], (1 - is_m) * data["X"]], axis=1)
+        a, b = 1 / self.beta_prior_std**2, 1 / self.intra_group_std**2
+        prior_precision = np.kron(np.array([[a + b, -b], [-b, b]]), np.eye(data["d"]))
+        return X, data["ml_logit"], prior_precision
+
+    def _get_test_design(self, test_data):
+        is_m2 = test_data["is_m2"].reshape(-1, 1)
+        X2 = np.concatenate([is_m2 * test_data["X2"], (1 - is_m2) * test_data["X2"]], axis=1)
+        return X2, test_data["ml_logit2"]
+
     def fit_predict(self, train_df, test_df, feat_cols=None):
         if not feat_cols:
             feat_cols = self.feat_cols
-        if self.stan_model is None:
-            self._load_stan_model()
         # If there are PCA feats, I might as well include them in the scaling
         scale_ = np.sqrt((train_df[feat_cols]**2).mean(0))
         self.scale_ = scale_
@@ -99,20 +99,17 @@ class HierSymmetricModel(SimpleSymmetricModel):
         
         data = {
             "n": train_df.shape[0],
-            "n2": test_df.shape[0],
             "d": X_ml_train.shape[1],
             "y": y_train.astype(int).values,
             "beta_prior_std": self.beta_prior_std,
             "intra_group_std": self.intra_group_std,
             "is_m": is_m_train.values,
-            "is_m2": is_m_test.values,
             "X": X_ml_train,
             "ml_logit": ml_train.values,
+        }
+        test_data = {
+            "is_m2": is_m_test.values,
             "X2": X_ml_test,
             "ml_logit2": ml_test.values,
         }
-        if self.mcmc:
-            fit = self._fit_mcmc(data)
-            return fit["y_pred"].mean(0) 
-        fit = self._fit_opt(data)
-        return fit["y_pred"]
+        return self._fit_predict_data(data, test_data)
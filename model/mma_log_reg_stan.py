@@ -1,17 +1,16 @@
-import pystan 
-import pickle
-import hashlib
 import numpy as np 
 import pandas as pd 
 from sklearn.decomposition import PCA
 from scipy.special import expit, logit
-from db import HOME_DIR
+from scipy.linalg import cholesky, solve_triangular
+from model.stan_registry import get_stan_model
 
+# Only the training data goes to Stan. The test data is predicted afterwards,
+# in NumPy, from the draws of beta (see BaseStanModel._fit_predict_data)
 code = """
 
 data {
     int<lower=0> n;                     // number of data points in training data
-    int<lower=0> n2;                    // number of data points in test data
     int<lower=1> d;                     // explanatory variable dimension
     int<lower=0,upper=1> y[n];          // response variable
     real<lower=0> beta_prior_std;       // prior scale on beta
@@ -19,23 +18,16 @@ data {
     matrix[n, d] X;                     // explanatory variable
     vector[n] ml_logit;                   // logit of the opening money line
 
-    matrix[n2, d] X2;                   // test data
-    vector[n2] ml_logit2;                 // test data
-
 }
 
 parameters {
     vector[d] beta;
 }
 
-transformed parameters {
-    vector[n] eta;
-    vector[n2] eta2;
-    eta = ml_logit + (X * beta);      // linear predictor
-    eta2 = ml_logit2 + (X2 * beta);   // linear predictor for test data
-}
-
 model {
+    // linear predictor. Local to the model block, so it isn't saved with each draw
+    vector[n] eta = ml_logit + (X * beta);
+
     for(i in 1:d){
         beta[i] ~ normal(0, beta_prior_std);
         //beta[i] ~ cauchy(0, beta_prior_std); //prior for slopes following gelman 2008
@@ -44,44 +36,196 @@ model {
     // observation model
     y ~ bernoulli_logit(eta);
 }
-
-generated quantities {
-    vector[n2] y_pred;
-    y_pred = inv_logit(eta2);  // y values predicted for test data
-}
 """
 
 
+def _fit_logistic_map(X, offset, y, prior_precision, tol=1e-8, max_iter=100):
+    """
+    Posterior mode of the logistic regression y ~ bernoulli_logit(offset + X @ theta),
+    with the Gaussian prior theta ~ N(0, inv(prior_precision)), by Newton's method.
+    The log posterior is concave, so this is the same mode that Stan's
+    optimizing() finds. X is small and dense, so each Newton step is one
+    dense (d, d) solve.
+    Returns (theta, hess), hess being the Hessian of the negative log
+    posterior at theta.
+    """
+    def get_loss(eta, theta):
+        return np.sum(np.logaddexp(0, eta) - y * eta) + 0.5 * theta @ prior_precision @ theta
+
+    theta = np.zeros(X.shape[1])
+    eta = offset + X @ theta
+    loss = get_loss(eta, theta)
+    for _ in range(max_iter):
+        p = expit(eta)
+        grad = X.T @ (p - y) + prior_precision @ theta
+        if np.max(np.abs(grad)) <= tol:
+            break
+        hess = (X.T * (p * (1 - p))) @ X + prior_precision
+        step = -np.linalg.solve(hess, grad)
+        # backtracking line search, in case the first steps overshoot
+        step_size = 1.0
+        while True:
+            new_theta = theta + step_size * step
+            new_eta = offset + X @ new_theta
+            new_loss = get_loss(new_eta, new_theta)
+            if new_loss <= loss + 1e-4 * step_size * (grad @ step) or step_size < 1e-10:
+                break
+            step_size *= 0.5
+        theta, eta, loss = new_theta, new_eta, new_loss
+    p = expit(eta)
+    hess = (X.T * (p * (1 - p))) @ X + prior_precision
+    return theta, hess
+
+def _expit_normal_moments(mean, var, n_nodes=32):
+    """
+    Mean and variance of expit(eta), for eta ~ N(mean, var) elementwise,
+    by Gauss-Hermite quadrature.
+    """
+    nodes, weights = np.polynomial.hermite_e.hermegauss(n_nodes)
+    weights = weights / weights.sum()
+    p = expit(mean[:, None] + np.sqrt(var)[:, None] * nodes)
+    p_mean = p @ weights
+    return p_mean, np.maximum((p**2) @ weights - p_mean**2, 0)
+
+
 class BaseStanModel(object):
+    # names of the parameter vectors, in the order that _get_map_problem
+    # and _get_test_design stack them
+    map_param_names = []
     
     def _load_stan_model(self):
-        # persistent hash: https://stackoverflow.com/a/2511075
-        code_hash = int(hashlib.md5(self.code.encode('ascii')).hexdigest(), 16)
-        path = f"{HOME_DIR}/stan_builds/{code_hash}.pkl"
-        try:
-            with open(path, 'rb') as f:
-                self.stan_model = pickle.load(f)
-        except:
-            print(f"couldn't pickle.load from path {path}, so we'll compile and dump there")
-            self.stan_model = pystan.StanModel(model_code=self.code)
-            with open(path, 'wb') as f:
-                pickle.dump(self.stan_model, f)
+        # shared by every instance in this process, see model/stan_registry.py
+        self.stan_model = get_stan_model(self.code)
                 
     def _fit_mcmc(self, data):
+        if self.stan_model is None:
+            self._load_stan_model()
         self.fit = self.stan_model.sampling(data=data, iter=self.num_samples, 
                                        chains=self.num_chains)
         return self.fit
     
     def _fit_opt(self, data):
+        if self.stan_model is None:
+            self._load_stan_model()
         self.fit = self.stan_model.optimizing(data=data)
         return self.fit
 
+    def _get_map_problem(self, data):
+        """
+        The posterior of the Stan model, as a logistic regression for
+        _fit_logistic_map. Returns (X, offset, prior_precision): the design
+        matrix and offset for the training data, and the prior precision of
+        the stacked parameters.
+        """
+        raise NotImplementedError()
+
+    def _get_test_design(self, test_data):
+        """
+        Returns (X2, offset2), such that y_pred = expit(offset2 + X2 @ theta)
+        for the stacked parameters theta.
+        """
+        raise NotImplementedError()
+
+    def _stack_params(self, fit):
+        """
+        The map_param_names of a Stan fit, side by side. (n_draws, n_params)
+        for sampling(), or (n_params,) for optimizing().
+        """
+        return np.concatenate([fit[name] for name in self.map_param_names], axis=-1)
+
+    def _fit_map(self, data):
+        """
+        Same as _fit_opt, but finds the posterior mode in NumPy rather than
+        in Stan. Takes milliseconds, and never needs a compiled model.
+        Returns a dict like optimizing() does, with each of map_param_names
+        and y_pred for the test data in _X2, _offset2.
+        """
+        X, offset, prior_precision = self._get_map_problem(data)
+        theta, _ = _fit_logistic_map(X, offset, data["y"], prior_precision)
+        self.fit = dict(zip(self.map_param_names, np.split(theta, len(self.map_param_names))))
+        self.fit["y_pred"] = expit(self._offset2 + self._X2 @ theta)
+        return self.fit
+
+    def _fit_laplace(self, data):
+        """
+        Laplace approximation to the posterior: a Gaussian centered on the
+        mode from _fit_map, with covariance inv(hess). Each test row's eta2 is
+        then Gaussian too, so the posterior mean and variance of y_pred come
+        out of a 1-d quadrature per row, with no sampling at all.
+        Returns a dict like _fit_map, with y_pred the posterior mean, and
+        y_pred_var the posterior variance. Use sample_y_pred for draws.
+        """
+        X, offset, prior_precision = self._get_map_problem(data)
+        theta, hess = _fit_logistic_map(X, offset, data["y"], prior_precision)
+        # hess = L L^T, so cov = L^-T L^-1, and var(x @ theta) = ||L^-1 x||^2
+        self._laplace_mean = theta
+        self._laplace_chol = cholesky(hess, lower=True)
+        X2, offset2 = self._X2, self._offset2
+        eta2_var = np.sum(solve_triangular(self._laplace_chol, X2.T, lower=True)**2, axis=0)
+        self.fit = dict(zip(self.map_param_names, np.split(theta, len(self.map_param_names))))
+        self.fit["y_pred"], self.fit["y_pred_var"] = _expit_normal_moments(offset2 + X2 @ theta,
+                                                                            eta2_var)
+        return self.fit
+
+    def sample_y_pred(self, n_draws, rows=None, random_state=None):
+        """
+        Draws of y_pred from the Laplace posterior of the last fit_predict
+        (which must have had laplace=True), for just the requested test rows.
+        rows: indices of the test rows to draw for, or None for all of them.
+        Returns an (n_draws, n_rows) array.
+        """
+        if getattr(self, "_laplace_mean", None) is None:
+            raise ValueError("sample_y_pred needs the Laplace posterior, "
+                             "fit_predict with laplace=True first")
+        X2, offset2 = self._X2, self._offset2
+        if rows is not None:
+            X2, offset2 = X2[rows], offset2[rows]
+        rng = np.random.default_rng(random_state)
+        z = rng.standard_normal((len(self._laplace_mean), n_draws))
+        # theta = mean + L^-T z has covariance L^-T L^-1 = inv(hess)
+        thetas = self._laplace_mean[:, None] + solve_triangular(self._laplace_chol, z,
+                                                                lower=True, trans="T")
+        return expit(offset2[:, None] + X2 @ thetas).T
+
+    def _fit_predict_data(self, data, test_data):
+        """
+        Fit on data as the constructor asked, and return y_pred for
+        test_data. Stan only ever sees data, so the compiled model doesn't
+        care how many test rows there are, and the test predictions are
+        made here from the fitted parameters.
+        """
+        self._X2, self._offset2 = self._get_test_design(test_data)
+        # only _fit_laplace sets these, so they never outlive a laplace fit
+        self._laplace_mean, self._laplace_chol = None, None
+        if self.mcmc:
+            fit = self._fit_mcmc(data)
+            thetas = self._stack_params(fit)
+            # posterior mean of y_pred, over the draws of theta
+            return expit(self._offset2[:, None] + self._X2 @ thetas.T).mean(1)
+        if self.laplace:
+            fit = self._fit_laplace(data)
+        elif self.stan_opt:
+            fit = self._fit_opt(data)
+            fit["y_pred"] = expit(self._offset2 + self._X2 @ self._stack_params(fit))
+        else:
+            fit = self._fit_map(data)
+        return fit["y_pred"]
+
 
 class SimpleSymmetricModel(BaseStanModel):
+    map_param_names = ["beta"]
         
     def __init__(self, feat_cols, beta_prior_std=0.1, target_col="targetWin",
             p_fighter_implied_col="p_fighter_implied",
-            mcmc=False, num_chains=4, num_samples=1000):
+            mcmc=False, num_chains=4, num_samples=1000, stan_opt=False, laplace=False):
+        """
+        mcmc: if True, predict with the posterior mean from Stan's sampler.
+            Otherwise, predict with the posterior mode.
+        stan_opt: if True, find the posterior mode with Stan's optimizing(),
+            rather than with _fit_map.
+        laplace: if True (and mcmc is False), predict with the posterior mean
+            under the Laplace approximation. See _fit_laplace.
+        """
         self.feat_cols = feat_cols
         self.beta_prior_std = float(beta_prior_std)
         self.target_col = target_col 
@@ -92,13 +236,20 @@ class SimpleSymmetricModel(BaseStanModel):
         self.mcmc = mcmc
         self.num_chains = num_chains
         self.num_samples = num_samples
+        self.stan_opt = stan_opt
+        self.laplace = laplace
         self.stan_model = None
+
+    def _get_map_problem(self, data):
+        prior_precision = np.eye(data["d"]) / self.beta_prior_std**2
+        return data["X"], data["ml_logit"], prior_precision
+
+    def _get_test_design(self, test_data):
+        return test_data["X2"], test_data["ml_logit2"]
         
     def fit_predict(self, train_df, test_df, feat_cols=None):
         if not feat_cols:
             feat_cols = self.feat_cols
-        if self.stan_model is None:
-            self._load_stan_model()
         # If there are PCA feats, I might as well include them in the scaling
         scale_ = np.sqrt((train_df[feat_cols]**2).mean(0))
         self.scale_ = scale_
@@ -115,17 +266,14 @@ class SimpleSymmetricModel(BaseStanModel):
         
         data = {
             "n": train_df.shape[0],
-            "n2": test_df.shape[0],
             "d": X_ml_train.shape[1],
             "y": y_train.astype(int).values,
             "beta_prior_std": self.beta_prior_std,
             "X": X_ml_train,
             "ml_logit": ml_train.values,
+        }
+        test_data = {
             "X2": X_ml_test,
             "ml_logit2": ml_test.values,
         }
-        if self.mcmc:
-            fit = self._fit_mcmc(data)
-            return fit["y_pred"].mean(0) 
-        fit = self._fit_opt(data)
-        return fit["y_pred"]
\ No newline at end of file
+        return self._fit_predict_data(data, test_data)
\ No newline at end of file
@@ -0,0 +1,151 @@
+"""
+A process-wide registry of compiled Stan models.
+
+Compiling a Stan model takes minutes, so each model is compiled once, pickled
+to stan_builds/, and loaded from there afterwards. Within a process, each model
+is only unpickled once, no matter how many SimpleSymmetricModel or
+HierSymmetricModel instances ask for it. Builds take a lockfile, so parallel
+workers that all find a model missing compile it once between them, rather
+than once each.
+
+Compile all the models ahead of time, so that a backtest never has to:
+    python -m model.stan_registry
+
+Example:
+    stan_model = get_stan_model(code)  # compiles if need be, then loads
+    registry = get_registry()
+    registry.verify(code)              # True if the build is usable
+"""
+
+import os
+import time
+import fcntl
+import pickle
+import hashlib
+from db import HOME_DIR
+
+
+class StanModelRegistry(object):
+
+    def __init__(self, build_dir=None):
+        """
+        build_dir: directory for the pickled builds. Defaults to stan_builds/
+            in the root of the project.
+        """
+        if build_dir is None:
+            build_dir = f"{HOME_DIR}/stan_builds"
+        self.build_dir = build_dir
+        # code hash --> loaded StanModel
+        self._stan_models = dict()
+
+    @staticmethod
+    def get_code_hash(code:str) -> int:
+        # persistent hash: https://stackoverflow.com/a/2511075
+        return int(hashlib.md5(code.encode('ascii')).hexdigest(), 16)
+
+    def get_path(self, code:str) -> str:
+        return f"{self.build_dir}/{self.get_code_hash(code)}.pkl"
+
+    def build(self, code:str, force=False, rebuild_broken=False):
+        """
+        Compile code and pickle the result to get_path(code), unless it's
+        already there. Holds a lockfile while compiling, and if another process
+        finished the build while we waited for the lock, just uses theirs.
+        force: compile even if there's already a build.
+        rebuild_broken: compile if the build there doesn't load. When several
+            processes find the same broken build, the first one to get the
+            lock rebuilds it, and the rest load that.
+        """
+        path = self.get_path(code)
+        with open(f"{path}.lock", "w") as lock_file:
+            # blocks until no one else is building this model. The lock is
+            # released if the process holding it dies
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                if os.path.exists(path) and not force:
+                    if not rebuild_broken or self.verify(code):
+                        return
+                # imported here rather than at the top, so that the models'
+                # NumPy fits work without pystan installed
+                import pystan
+                print(f"compiling stan model {self.get_code_hash(code)}...")
+                start = time.time()
+                stan_model = pystan.StanModel(model_code=code)
+                print(f"compiled stan model in {time.time() - start:.1f}s, writing to {path}")
+                # write to a temporary file first, so that a concurrent load
+                # never sees half a build
+                temp_path = f"{path}.{os.getpid()}.tmp"
+                with open(temp_path, "wb") as f:
+                    pickle.dump(stan_model, f, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(temp_path, path)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def load(self, code:str):
+        """
+        Unpickle the build of code. Raises if there isn't a usable one.
+        """
+        # unpickling a StanModel needs pystan, see build
+        import pystan
+        path = self.get_path(code)
+        start = time.time()
+        with open(path, "rb") as f:
+            stan_model = pickle.load(f)
+        if stan_model.model_code != code:
+            raise ValueError(f"build at {path} was compiled from different code")
+        print(f"loaded stan model from {path} in {time.time() - start:.2f}s")
+        return stan_model
+
+    def verify(self, code:str) -> bool:
+        """
+        True if there's a build of code that loads.
+        """
+        try:
+            self.load(code)
+        except Exception as e:
+            print(f"stan model build at {self.get_path(code)} isn't usable: {e!r}")
+            return False
+        return True
+
+    def get(self, code:str):
+        """
+        The compiled StanModel for code. Loaded from disk the first time it's
+        asked for in this process, and compiled first if there's no build.
+        A build that fails to load gets recompiled, but loudly.
+        """
+        code_hash = self.get_code_hash(code)
+        if code_hash not in self._stan_models:
+            if not os.path.exists(self.get_path(code)):
+                self.build(code)
+            try:
+                stan_model = self.load(code)
+            except Exception as e:
+                print(f"couldn't load stan model from {self.get_path(code)} ({e!r}), rebuilding")
+                self.build(code, rebuild_broken=True)
+                stan_model = self.load(code)
+            self._stan_models[code_hash] = stan_model
+        return self._stan_models[code_hash]
+
+
+_registry = None
+
+def get_registry() -> StanModelRegistry:
+    """
+    The registry shared by everything in this process.
+    """
+    global _registry
+    if _registry is None:
+        _registry = StanModelRegistry()
+    return _registry
+
+def get_stan_model(code:str):
+    return get_registry().get(code)
+
+
+if __name__ == "__main__":
+    from model.mma_log_reg_stan import code
+    from model.mma_hier_log_reg_stan import hier_code
+    registry = get_registry()
+    for model_code in [code, hier_code]:
+        registry.build(model_code)
+        assert registry.verify(model_code)